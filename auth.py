@@ -1,3 +1,6 @@
+import copy
+import uuid
+import calendar
 from datetime import datetime, timedelta
 
 import jwt
@@ -9,6 +12,7 @@ from models import User
 from utils import flash, get_token, set_session_user
 from constants import BSVariant
 from exceptions import AuthenticationException
+from revocation import get_token_key
 
 
 class TokenAuth(object):
@@ -40,7 +44,7 @@ class TokenAuth(object):
         else:
             expiration += timedelta(minutes=expiration_minutes)
         token = jwt.encode(
-            {"user_id": user.id, "exp": expiration},
+            {"user_id": user.id, "exp": expiration, "jti": uuid.uuid4().hex},
             config.JWT_SIGN_KEY,
             algorithm=config.JWT_SIGN_ALGORITHM)
         session["token"] = token
@@ -52,10 +56,14 @@ class TokenAuth(object):
                 "expiration_utc": str(expiration)}
 
     async def _logout(self):
-        """Logout user by blacklisting token."""
+        """Logout user by revoking token."""
         token = get_token(self.request)
-        if token and token not in config.BLACKLISTED_JWT:
-            config.BLACKLISTED_JWT.append(token)
+        token_data = self._decode_token(token) if token else None
+        if token_data:
+            expires_at = token_data.get("exp") or calendar.timegm(
+                (datetime.utcnow() + timedelta(days=365)).utctimetuple())
+            await self.request.app["revocation_store"].revoke(
+                get_token_key(token, token_data), expires_at)
         session = await get_session(self.request)
         session.clear()
         flash(self.request, "Logout successful",
@@ -70,16 +78,13 @@ class TokenAuth(object):
         if not token:
             raise AuthenticationException("Missing auth token")
 
-        if token in config.BLACKLISTED_JWT:
-            raise AuthenticationException("Blacklisted token")
-        try:
-            token_data = jwt.decode(
-                token,
-                config.JWT_SIGN_KEY,
-                algorithms=config.JWT_SIGN_ALGORITHM)
-        except jwt.exceptions.InvalidTokenError:
+        token_data = self._decode_token(token)
+        if not token_data:
             raise AuthenticationException("Invalid token")
-        user = await User.get_by_id(token_data.get("user_id"))
+        if self.request.app["revocation_store"].is_revoked(
+                get_token_key(token, token_data)):
+            raise AuthenticationException("Blacklisted token")
+        user = await self._get_user_by_id(token_data.get("user_id"))
         if not user:
             raise AuthenticationException("Please log in")
         else:
@@ -87,3 +92,28 @@ class TokenAuth(object):
                 raise AuthenticationException("User is not active")
             set_session_user(session, user)
         return user
+
+    def _decode_token(self, token):
+        """Returns token claims, None for invalid or expired tokens."""
+        try:
+            return jwt.decode(
+                token,
+                config.JWT_SIGN_KEY,
+                algorithms=config.JWT_SIGN_ALGORITHM)
+        except jwt.exceptions.InvalidTokenError:
+            return None
+
+    async def _get_user_by_id(self, user_id):
+        """Gets user from the per-process user cache or from database."""
+        user_cache = self.request.app.get("user_cache")
+        if user_cache is None:
+            return await User.get_by_id(user_id)
+        user_data = user_cache.get(user_id)
+        if user_data is None:
+            user = await User.get_by_id(user_id)
+            if user:
+                user_cache.set(user_id, copy.deepcopy(user.__data__))
+            return user
+        # Every request gets its own instance and copies of its lists
+        # (permissions, ip_list), cached data stays intact
+        return User(**copy.deepcopy(user_data))
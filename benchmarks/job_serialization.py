@@ -0,0 +1,98 @@
+"""
+Compares pickled and compact job state formats of PeeweeJobStore.
+
+Reports bytes written per scheduler tick (every job fired once) and CPU
+time spent in PeeweeJobStore._reconstitute_job. Runs without database.
+
+Usage: python -m benchmarks.job_serialization [jobs]
+"""
+import sys
+import json
+import timeit
+from datetime import datetime
+from types import SimpleNamespace
+
+from apscheduler.job import Job
+from apscheduler.schedulers.base import BaseScheduler
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.util import datetime_to_utc_timestamp
+from pytz import utc
+
+from jobstores.peewee_jobstore import PeeweeJobStore, COMPACT_COLUMNS
+
+
+# Size of the next_run_time double precision column
+TIMESTAMP_BYTES = 8
+
+
+async def noop(*args, **kwargs):
+    pass
+
+
+class Scheduler(BaseScheduler):
+
+    def shutdown(self, wait=True):
+        pass
+
+    def wakeup(self):
+        pass
+
+
+def make_job(scheduler, i):
+    job = Job(scheduler, id="monitor_sockets__%s" % i,
+              func="benchmarks.job_serialization:noop",
+              trigger=CronTrigger(minute="*", second="0", timezone="EET"),
+              executor="default", args=["jobs.monitor_sockets", i, 1],
+              kwargs={"hosts": ["www.google.com", "www.example.com"],
+                      "url_templates": ["https://%s", "http://%s"],
+                      "emails": ["user@your_mail_server.com"],
+                      "timeout": 9},
+              name="Monitor sockets %s" % i, misfire_grace_time=1,
+              coalesce=True, max_instances=1)
+    job.next_run_time = job.trigger.get_next_fire_time(
+        None, datetime.now(utc))
+    return job
+
+
+def make_row(jobstore, job):
+    columns = jobstore._serialize_job(job.__getstate__())
+    return SimpleNamespace(
+        id=job.id,
+        next_run_time=datetime_to_utc_timestamp(job.next_run_time),
+        **columns)
+
+
+def column_bytes(columns):
+    size = 0
+    for key in ("job_state", "func") + COMPACT_COLUMNS[1:]:
+        value = columns.get(key)
+        if isinstance(value, bytes):
+            size += len(value)
+        elif isinstance(value, str):
+            size += len(value.encode("utf-8"))
+        elif value is not None:
+            size += len(json.dumps(value).encode("utf-8"))
+    return size
+
+
+if __name__ == "__main__":
+    jobs_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    scheduler = Scheduler(timezone=utc)
+    jobs = [make_job(scheduler, i) for i in range(jobs_count)]
+    pickle_bytes = 0
+    for title, compact_state in (("pickle", False), ("compact", True)):
+        jobstore = PeeweeJobStore(compact_state=compact_state)
+        rows = [make_row(jobstore, job) for job in jobs]
+        row_bytes = sum(column_bytes(vars(row)) for row in rows)
+        if not compact_state:
+            pickle_bytes = row_bytes
+        seconds = min(timeit.repeat(
+            lambda: [jobstore._reconstitute_job(row) for row in rows],
+            number=1, repeat=5))
+        print("%-8s definition %5d B/job  reconstitute %7.2f us/job" % (
+            title, row_bytes // jobs_count, seconds / jobs_count * 1e6))
+    # Every fired job used to have its whole pickled state rewritten,
+    # now only next_run_time is written unless the definition changed
+    tick_bytes = jobs_count * TIMESTAMP_BYTES
+    print("bytes written per tick of %s jobs: %s before, %s now" % (
+        jobs_count, tick_bytes + pickle_bytes, tick_bytes))
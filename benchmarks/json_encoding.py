@@ -0,0 +1,60 @@
+"""
+Compares encoding a page of user logs the way log controllers used to,
+json.dumps with json.loads back and json.dumps of the whole response,
+with single-pass utils.json_dumps. Runs without database.
+
+Usage: python -m benchmarks.json_encoding [repeat]
+"""
+import sys
+import json
+import timeit
+from datetime import datetime, timedelta
+
+import config
+from constants import ControllerResult
+from responses import ControllerResponse
+from utils import convert_types, json_dumps
+
+
+def create_logs():
+    created_at = datetime.now()
+    duration = timedelta(seconds=0.2)
+    return [{"id": i,
+             "user": 1,
+             "log_type": 3,
+             "request_data": json.dumps({"id": str(i), "page": "1"}),
+             "request_ip": "127.0.0.1",
+             "request_url": "http://localhost:6999/users?id=%s" % i,
+             "request_method": "GET",
+             "response_data": json.dumps({"ok": True, "data": None}),
+             "error": None,
+             "created_at": created_at - timedelta(seconds=i),
+             "finished_at": created_at - timedelta(seconds=i) + duration}
+            for i in range(config.ITEMS_PER_PAGE)]
+
+
+def encode_round_trip(logs):
+    items = json.loads(json.dumps(logs, default=convert_types))
+    return json.dumps(ControllerResponse(
+        ControllerResult.Success, data={"items": items})).encode("utf-8")
+
+
+def encode_single_pass(logs):
+    return json_dumps(ControllerResponse(
+        ControllerResult.Success, data={"items": logs}))
+
+
+def run(repeat):
+    logs = create_logs()
+    assert json.loads(encode_round_trip(logs)) == json.loads(
+        encode_single_pass(logs))
+    for title, encode in (("round trip", encode_round_trip),
+                          ("single pass", encode_single_pass)):
+        seconds = min(timeit.repeat(
+            lambda: encode(logs), number=repeat, repeat=5))
+        print("%-11s %8.2f us per page" % (title, seconds / repeat * 10 ** 6))
+
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    run(repeat)
@@ -0,0 +1,96 @@
+"""
+Measures event loop latency while the scheduler processes due jobs.
+
+Runs the scheduler with and without non-blocking job store mode against
+a scratch job table and probes how late a periodic asyncio.sleep wakes up.
+Requires the database configured in config.DB_CONFIG.
+
+Measured with 1000 jobs for 10 seconds against local Postgres on a single
+CPU core:
+
+    blocking     p50   16.87 ms  p99  339.23 ms  max  413.05 ms
+    non-blocking p50    0.43 ms  p99    6.58 ms  max   16.31 ms
+
+Usage: python -m benchmarks.loop_latency [jobs] [seconds]
+"""
+import sys
+import time
+import asyncio
+import statistics
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.triggers.interval import IntervalTrigger
+from pytz import utc
+
+from jobstores.peewee_jobstore import PeeweeJobStore
+from schedulers.asyncio_scheduler import (NonBlockingAsyncIOScheduler,
+                                          ThreadSafeAsyncIOExecutor)
+from models import APSchedulerJob
+
+
+PROBE_INTERVAL = 0.01
+
+
+class BenchmarkJob(APSchedulerJob):
+
+    class Meta:
+        table_name = "apscheduler_jobs_benchmark"
+
+
+async def noop(*args, **kwargs):
+    pass
+
+
+async def probe_latency(duration):
+    lags = []
+    loop = asyncio.get_event_loop()
+    finish_at = loop.time() + duration
+    while loop.time() < finish_at:
+        started_at = loop.time()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(loop.time() - started_at - PROBE_INTERVAL)
+    return lags
+
+
+def run(scheduler_class, executor_class, jobs, duration):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    jobstore = PeeweeJobStore(jobs_t=BenchmarkJob)
+    scheduler = scheduler_class(
+        jobstores={"default": jobstore},
+        executors={"default": executor_class()},
+        job_defaults={"coalesce": True}, timezone=utc, event_loop=loop)
+    scheduler.start()
+    jobstore.remove_all_jobs()
+    for i in range(jobs):
+        scheduler.add_job("benchmarks.loop_latency:noop",
+                          IntervalTrigger(seconds=1, timezone=utc),
+                          id="job_%s" % i)
+    lags = loop.run_until_complete(probe_latency(duration))
+    scheduler.shutdown(wait=False)
+    loop.run_until_complete(asyncio.sleep(0.1))
+    loop.close()
+    return sorted(lags)
+
+
+def report(title, lags):
+    p99 = lags[int(len(lags) * 0.99) - 1]
+    print("%-12s p50 %7.2f ms  p99 %7.2f ms  max %7.2f ms" % (
+        title, statistics.median(lags) * 1000, p99 * 1000, lags[-1] * 1000))
+
+
+if __name__ == "__main__":
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    BenchmarkJob.create_table(safe=True)
+    try:
+        started_at = time.time()
+        report("blocking",
+               run(AsyncIOScheduler, AsyncIOExecutor, jobs, duration))
+        report("non-blocking",
+               run(NonBlockingAsyncIOScheduler, ThreadSafeAsyncIOExecutor,
+                   jobs, duration))
+        print("%s jobs, finished in %.1f s" % (jobs, time.time() - started_at))
+    finally:
+        BenchmarkJob.drop_table(safe=True)
@@ -0,0 +1,49 @@
+import time
+from collections import OrderedDict
+
+
+_missing = object()
+
+
+class TTLCache(object):
+    """
+    Dict-like cache whose entries expire ttl seconds after they are set.
+
+    When maxsize is reached the oldest entry is evicted.
+    """
+
+    def __init__(self, ttl, maxsize=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._data.pop(key, None)
+        self._data[key] = (
+            value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        if self.maxsize and len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return entry[0] if entry else default
+
+    def clear(self):
+        self._data.clear()
+
@@ -0,0 +1,212 @@
+import socket
+import asyncio
+import logging
+import smtplib
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import ClientSession, TCPConnector
+
+from cache import TTLCache
+
+# Errors of refused messages, the connection stays usable
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                  smtplib.SMTPDataError)
+
+
+class SMTPMailer(object):
+    """
+    Sends emails over a few long-lived SMTP connections.
+
+    Messages are put to a queue and sent by worker tasks. Every worker owns
+    one connection, which is opened (connect, STARTTLS, login) on the first
+    message and reused for the next ones. smtplib calls run in a dedicated
+    thread pool, so the event loop is never blocked. Broken or idle
+    connections closed by the server are reopened and the message is retried
+    once. Connections are kept when the server refuses a message.
+    """
+
+    def __init__(self, host, port, user=None, password=None, use_tls=True,
+                 connections=2, timeout=10, max_queue_size=1000):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_tls = use_tls
+        self.connections = connections
+        self.timeout = timeout
+        self.max_queue_size = max_queue_size
+        self.log = logging.getLogger("apscron")
+        self._queue = None
+        self._workers = []
+        self._executor = None
+
+    async def start(self):
+        self._queue = asyncio.Queue(self.max_queue_size)
+        self._executor = ThreadPoolExecutor(
+            self.connections, thread_name_prefix="apscron_smtp")
+        self._workers = [asyncio.ensure_future(self._work())
+                         for _ in range(self.connections)]
+
+    async def close(self):
+        """Sends queued messages and closes connections."""
+        if self._queue is None:
+            return
+        for _ in self._workers:
+            await self._queue.put(None)
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._executor.shutdown()
+        self._queue = None
+        self._workers = []
+
+    async def send(self, message, send_from, dest_to):
+        """Queues email message and waits until it is sent."""
+        if self._queue is None:
+            raise RuntimeError("SMTPMailer is not started")
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((message, send_from, list(dest_to), future))
+        return await future
+
+    async def _work(self):
+        loop = asyncio.get_event_loop()
+        connection = None
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is None:
+                    break
+                message, send_from, dest_to, future = item
+                try:
+                    connection, error = await loop.run_in_executor(
+                        self._executor, self._send, connection,
+                        message, send_from, dest_to)
+                except Exception as e:
+                    connection, error = None, e
+                if error:
+                    self.log.error("Unable to send email to %s", dest_to,
+                                   exc_info=error)
+                    if not future.done():
+                        future.set_exception(error)
+                elif not future.done():
+                    future.set_result(None)
+        finally:
+            if connection:
+                await loop.run_in_executor(
+                    self._executor, self._disconnect, connection)
+
+    def _send(self, connection, message, send_from, dest_to):
+        """Sends message, returns connection to reuse and the error of a
+        message refused by the server, the connection is kept then.
+        """
+        if connection:
+            try:
+                connection.sendmail(send_from, dest_to, message.as_string())
+                return connection, None
+            except MESSAGE_ERRORS as e:
+                return connection, e
+            except (smtplib.SMTPServerDisconnected, ConnectionError,
+                    TimeoutError):
+                # Closed by server or broken, retried on a new connection
+                self._disconnect(connection)
+            except Exception:
+                self._disconnect(connection)
+                raise
+        connection = self._connect()
+        try:
+            connection.sendmail(send_from, dest_to, message.as_string())
+        except MESSAGE_ERRORS as e:
+            return connection, e
+        except Exception:
+            self._disconnect(connection)
+            raise
+        return connection, None
+
+    def _connect(self):
+        connection = smtplib.SMTP(
+            host=self.host, port=self.port, timeout=self.timeout)
+        try:
+            connection.ehlo()
+            if self.use_tls:
+                connection.starttls()
+                connection.ehlo()
+            if self.user:
+                connection.login(self.user, self.password)
+        except Exception:
+            self._disconnect(connection)
+            raise
+        return connection
+
+    def _disconnect(self, connection):
+        try:
+            connection.quit()
+        except OSError:
+            connection.close()
+
+
+class ClientSessionRegistry(object):
+    """
+    Application-scoped aiohttp client sessions.
+
+    Sessions are created on first use and kept until the application stops,
+    so their connection pools (keep-alive connections, resolved hosts)
+    are shared by all jobs and all runs. Every session limits the amount of
+    connections in total and per host.
+    """
+
+    def __init__(self, limit=100, limit_per_host=10, keepalive_timeout=30,
+                 ttl_dns_cache=300):
+        self.connector_config = {"limit": limit,
+                                 "limit_per_host": limit_per_host,
+                                 "keepalive_timeout": keepalive_timeout,
+                                 "ttl_dns_cache": ttl_dns_cache}
+        self._sessions = {}
+
+    def get(self, name="default"):
+        """Gets session by name, creates it on first call."""
+        session = self._sessions.get(name)
+        if session is None or session.closed:
+            session = ClientSession(
+                connector=TCPConnector(**self.connector_config))
+            self._sessions[name] = session
+        return session
+
+    async def close(self):
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            await session.close()
+
+
+class DNSResolver(object):
+    """
+    Resolves host names to IP addresses without blocking the event loop.
+
+    Results are cached for ttl seconds and concurrent lookups of the same
+    host share a single getaddrinfo call.
+    """
+
+    def __init__(self, ttl=300, maxsize=10000):
+        self._cache = TTLCache(ttl, maxsize=maxsize)
+        self._pending = {}
+
+    async def resolve(self, host):
+        """Returns IP address of the host, raises OSError on failure."""
+        ip = self._cache.get(host)
+        if ip is not None:
+            return ip
+        future = self._pending.get(host)
+        if future is None:
+            future = asyncio.ensure_future(self._resolve(host))
+            self._pending[host] = future
+            future.add_done_callback(
+                lambda f: self._pending.pop(host, None))
+        return await asyncio.shield(future)
+
+    def remember(self, host, ip):
+        """Caches IP address the host is known to be reachable at."""
+        self._cache.set(host, ip)
+
+    async def _resolve(self, host):
+        addresses = await asyncio.get_event_loop().getaddrinfo(
+            host, None, type=socket.SOCK_STREAM)
+        ip = addresses[0][4][0]
+        self._cache.set(host, ip)
+        return ip
@@ -10,10 +10,16 @@ COOKIE_NAME = "APScron_session"
 # Cookie max age in seconds
 MAX_AGE = 60 * 60
 
-# Both signing key and blacklist are reset when application restarts
-JWT_SIGN_KEY = str(os.urandom(32))
+# Signing key has to be shared by all apscron processes and kept between
+# restarts for tokens to stay valid, otherwise a random key is generated
+# and tokens are invalidated when application restarts
+JWT_SIGN_KEY = os.environ.get("APSCRON_JWT_SIGN_KEY") or str(os.urandom(32))
 JWT_SIGN_ALGORITHM = "HS256"
-BLACKLISTED_JWT = []
+# Revoked (logged out) tokens, see revocation.RevocationStore.
+# With "persist" enabled revoked tokens are stored in the database, so
+# they stay revoked after restart, and other processes load them every
+# "sync_interval" seconds
+REVOCATION_CONFIG = {"persist": True, "sync_interval": 10}
 
 # APScron database settings
 DB_CONFIG = {"user": "apscron",
@@ -26,6 +32,47 @@ DB_CONFIG = {"user": "apscron",
              "register_hstore": False,
              "server_side_cursors": False}
 
+# Scheduler settings. When "non_blocking" is enabled job store queries made
+# on every scheduler wakeup run in a dedicated worker thread instead of
+# the aiohttp event loop
+SCHEDULER_CONFIG = {"non_blocking": True}
+
+# Job store settings, passed to PeeweeJobStore as keyword arguments.
+# "cache_jobs" keeps all jobs in memory and only writes to the database,
+# when several apscron processes share the jobs table it also requires
+# "notify_channel", so jobs changed by other processes are reloaded.
+# "batch_updates" writes next run times of all jobs fired in a single
+# scheduler wakeup with one multi-row UPDATE. "compact_state" stores job
+# definitions in JSON columns instead of pickled job state.
+# "notify_channel" is the Postgres channel used to let other apscron
+# processes know about added, changed and removed jobs.
+# "claim_jobs" makes several apscron processes split due jobs between
+# them instead of each running every job, it requires "cache_jobs" off.
+# Claimed job is leased to the process until its run finishes, jobs
+# whose lease wasn't released within "lease_seconds" (e.g. the process
+# died) are claimed again by other processes. Keep it above the longest
+# job run time
+JOBSTORE_CONFIG = {"cache_jobs": True,
+                   "batch_updates": True,
+                   "compact_state": True,
+                   "notify_channel": "apscron_jobs",
+                   "claim_jobs": False,
+                   "lease_seconds": 300,
+                   "claim_limit": None}
+
+# Job executor profiles. "asyncio" executor runs jobs on the aiohttp event
+# loop and suits jobs which only await I/O. Jobs with blocking code should
+# use "threadpool", CPU bound jobs "processpool" (worker processes are
+# spawned, not forked). Jobs of thread and process pools run on their own
+# event loop and write job logs with synchronous queries
+EXECUTORS = {
+    "default": {"type": "asyncio", "label": "Event loop"},
+    "threadpool": {"type": "threadpool", "label": "Thread pool",
+                   "max_workers": 20},
+    "processpool": {"type": "processpool", "label": "Process pool",
+                    "max_workers": 5}
+}
+
 # APScron logging settings
 DIRS = {
     "LOG_TO": os.path.join(os.path.expanduser("~"), "logs/apscron"),
@@ -49,7 +96,36 @@ DEFAULT_TIMEZONE = "EET"
 
 # Pagination parameters
 PAGE_PARAMETER = "page"
+# Log lists continue after the item encoded in this parameter instead of
+# skipping pages with OFFSET
+CURSOR_PARAMETER = "cursor"
 ITEMS_PER_PAGE = 25
+# How log lists count total items: "exact" runs COUNT(*) on every request,
+# "estimate" uses planner statistics and "none" skips counting
+LOG_COUNT_MODE = "estimate"
+# Logs read per query by log exports
+LOG_EXPORT_BATCH_SIZE = 1000
+# Log text filters search substrings with ILIKE. With "trigram_indexes"
+# init_db creates the pg_trgm extension and GIN trigram indexes of the
+# filtered columns, so searches don't scan whole tables. Indexes of existing
+# tables are built concurrently, except partitioned ones, whose writes are
+# locked meanwhile. Shorter than "min_length" values can't use the indexes
+# and are rejected
+LOG_SEARCH_CONFIG = {"trigram_indexes": True, "min_length": 3}
+# Range partitioning of log tables by creation time, see
+# partitions.LogPartitioner. When "enabled", init_db creates missing log
+# tables partitioned by "interval" ("day" or "month"), existing tables are
+# left as they are. Every "maintenance_interval" seconds partitions are
+# created "premake" intervals ahead and partitions older than "retention"
+# intervals are dropped, None keeps all of them. Rows of existing tables
+# older than "retention" are deleted instead, "delete_batch_size" rows
+# per transaction
+LOG_PARTITION_CONFIG = {"enabled": True,
+                        "interval": "month",
+                        "premake": 2,
+                        "retention": None,
+                        "maintenance_interval": 3600,
+                        "delete_batch_size": 10000}
 
 # Host for static/media files; leave empty string for localhost.
 # Production/stage values have to look like "https://static.host.com" or
@@ -61,6 +137,27 @@ SMTP_HOST = "smtp.your_mail_server.com"
 SMTP_PORT = 587
 SMTP_USER = "user@your_mail_server.com"
 SMTP_PASSWORD = "password"
+SMTP_USE_TLS = True
+# Amount of long-lived SMTP connections used to send job emails
+SMTP_CONNECTIONS = 2
+
+# HTTP client sessions shared by jobs, see clients.ClientSessionRegistry
+HTTP_CLIENT_CONFIG = {"limit": 100,
+                      "limit_per_host": 10,
+                      "keepalive_timeout": 30,
+                      "ttl_dns_cache": 300}
+# Seconds host IP addresses reported by jobs are cached for
+DNS_CACHE_TTL = 300
+
+# Buffered log writers settings, see log_writer.BufferedLogWriter.
+# Logs are written in batches of up to "max_batch" rows at least every
+# "flush_interval" seconds, writers wait for a flush once "max_pending"
+# rows are buffered. Writer metrics (rows written and pending, failed
+# flushes, flush lag) are logged every "metrics_interval" seconds
+LOG_WRITER_CONFIG = {"max_batch": 500,
+                     "flush_interval": 1,
+                     "max_pending": 10000,
+                     "metrics_interval": 300}
 
 # Default authentication class, performs authentication via
 # Authorization/cookie request header
@@ -69,3 +166,13 @@ DEFAULT_AUTH_CLASS = "TokenAuth"
 DEFAULT_AUTH_HEADER = "Authorization"
 # Token expiration in minutes
 DEFAULT_AUTH_EXPIRATION = 60
+# Password hashing settings, see passwords.PasswordHasher. "n", "r" and "p"
+# are scrypt cost parameters of new hashes, passwords hashed with other
+# parameters are rehashed on login. Hashing runs in "max_workers" threads,
+# at most "max_concurrency" hashes are queued or running at once
+PASSWORD_HASHER_CONFIG = {"n": 1024, "r": 8, "p": 16,
+                          "max_workers": 4,
+                          "max_concurrency": 16}
+# Seconds authenticated users are cached for by each apscron process.
+# Changes made through another process are picked up after this time
+USER_CACHE_TTL = 30
@@ -14,7 +14,7 @@ class Constant(type):
 
 permission = namedtuple("permission", "id name label")
 job_trigger = namedtuple("job_trigger", "id name label description")
-available_job = namedtuple("available_job", "name label")
+available_job = namedtuple("available_job", "name label executor")
 log_type = namedtuple("log_type", "id label")
 bs_variant = namedtuple("bs_variant", "id name label title")
 boolean_type = namedtuple("boolean_type", "id label")
@@ -37,6 +37,8 @@ class Permission(object, metaclass=Constant):
     JobPauseView = permission(14, "post_pause_job_view", "Pause/resume jobs")
     JobLogView = permission(15, "get_job_log_view", "View job log")
     ErrorLogView = permission(16, "get_error_log_view", "View error log")
+    JobReloadView = permission(17, "post_reload_job_view",
+                               "Reload job modules")
 
 
 class JobTrigger(object, metaclass=Constant):
@@ -53,8 +55,12 @@ class JobTrigger(object, metaclass=Constant):
 
 
 class AvailableJob(object, metaclass=Constant):
-    TestJob = available_job("test_job", "Test Job")
-    MonitorSockets = available_job("monitor_sockets", "Monitor sockets")
+    # Default executor of the job, one of config.EXECUTORS. Both jobs only
+    # await I/O (monitor_sockets sends reports through the async mailer),
+    # so they run on the event loop
+    TestJob = available_job("test_job", "Test Job", "default")
+    MonitorSockets = available_job(
+        "monitor_sockets", "Monitor sockets", "default")
 
 
 class BSVariant(object, metaclass=Constant):
@@ -91,6 +97,7 @@ class LogType(object, metaclass=Constant):
     CommonJobDataView = log_type(14, "Common job data view")
     CommonUserDataView = log_type(15, "Common user data view")
     LogView = log_type(16, "Log view")
+    JobReloadView = log_type(17, "Job reload")
 
 
 class BooleanType(object, metaclass=Constant):
@@ -128,5 +135,8 @@ filter_labels = {
     "is_active": "User is active",
     "error": "Specify error text",
     "traceback": "Specify error traceback text",
-    "job_id": "Specify Job ID"
+    "job_id": "Specify Job ID",
+    "user_id": "Specify User ID",
+    "name": "Specify Name",
+    "module": "Select Job module"
 }
@@ -1,3 +1,5 @@
+import json
+import base64
 import traceback
 from datetime import datetime
 from http import HTTPStatus
@@ -7,13 +9,13 @@ from operator import attrgetter
 from urllib.parse import unquote
 
 from peewee import (AutoField, BigAutoField, IntegerField,
-                    BigIntegerField, SmallIntegerField)
+                    BigIntegerField, SmallIntegerField, DateTimeField, Tuple)
 from aiohttp.web_response import StreamResponse
 from aiohttp.web_exceptions import HTTPRedirection
 
 import config
 from constants import (LogType, filter_labels, ControllerResult, BSVariant,
-                       BooleanType)
+                       BooleanType, AvailableJob)
 from models import ErrorLog, UserLog
 from utils import get_request_data, flash
 from responses import ControllerResponse
@@ -70,6 +72,15 @@ class BaseController(object):
             verified_data[key] = self.request_data["data"].get(key)
         return verified_data
 
+    async def _write_log(self, model, **data):
+        # Log rows are written in batches by background writers,
+        # so the response doesn't wait for the INSERT
+        log_writers = self.request.app.get("log_writers", {})
+        if model in log_writers:
+            await log_writers[model].write(**data)
+        else:
+            await self.db.create(model, **data)
+
     def _verify_user_ip(self):
         if self.user and self.user.ip_list:
             if self.request.remote not in self.user.ip_list:
@@ -83,6 +94,16 @@ class UniversalController(BaseController):
     select_filter_names = []
     daterange_filter_names = []
     text_like_filter_names = []
+    # Fields of keyset pagination, the last one has to be unique. Items are
+    # ordered by them descending and "cursor" request parameter continues
+    # the list after the item the cursor was made of. Only datetime and
+    # integer fields are supported
+    cursor_fields = ()
+    # How total items are counted: "exact" runs COUNT(*), "estimate" uses
+    # planner statistics and "none" skips counting
+    count_mode = "exact"
+    # Minimal length of text_like filter values
+    text_like_min_length = 0
 
     async def call(self, *args, **kwargs):
         try:
@@ -115,7 +136,7 @@ class UniversalController(BaseController):
             flash(self.request, str(e),
                   BSVariant.Danger.name, BSVariant.Danger.title)
             self.log.exception("%s finished with error" % self.class_name)
-            await self.db.create(
+            await self._write_log(
                 ErrorLog,
                 request_data=self.request_data["log_data"],
                 request_ip=self.request_data["ip"],
@@ -137,7 +158,7 @@ class UniversalController(BaseController):
             self.db_log_data["user"] = self.user
             self.db_log_data["finished_at"] = datetime.now()
             if self.save_log:
-                await self.db.create(self.log_model, **self.db_log_data)
+                await self._write_log(self.log_model, **self.db_log_data)
             return response
 
     async def _call(self, *args, **kwargs):
@@ -147,6 +168,9 @@ class UniversalController(BaseController):
         return self.model.select()
 
     def _order_query(self, q):
+        if self.cursor_fields:
+            return q.order_by(*[getattr(self.model, f).desc()
+                                for f in self.cursor_fields])
         return q.order_by(self.model.id.desc())
 
     async def _filter_query(self, q):
@@ -185,10 +209,14 @@ class UniversalController(BaseController):
                 q = q.where(attrgetter(arg)(self.model).between(start, end))
 
         for arg in self.text_like_filter_names:
-            if self.request.query.get(arg):
-                q = q.where(
-                    attrgetter(arg)(self.model).contains(
-                        self.request.query.get(arg)))
+            parameter = self.request.query.get(arg)
+            if parameter:
+                if len(parameter) < self.text_like_min_length:
+                    raise ServiceException(
+                        "%s filter requires at least %s characters" % (
+                            arg, self.text_like_min_length))
+                # ILIKE, served by trigram indexes of the field if any
+                q = q.where(attrgetter(arg)(self.model).contains(parameter))
 
         return self._order_query(q)
 
@@ -198,18 +226,80 @@ class UniversalController(BaseController):
             return int(curr_page)
         return 1
 
+    def _get_cursor(self):
+        cursor = self.request.query.get(config.CURSOR_PARAMETER)
+        if not cursor or not self.cursor_fields:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.cursor_fields):
+                raise ValueError(cursor)
+            return [datetime.fromisoformat(value)
+                    if isinstance(getattr(self.model, f), DateTimeField)
+                    else int(value)
+                    for f, value in zip(self.cursor_fields, values)]
+        except (ValueError, TypeError):
+            raise ServiceException("Invalid cursor %s" % cursor)
+
+    def _make_cursor(self, item):
+        values = [item[f].isoformat() if isinstance(item[f], datetime)
+                  else item[f] for f in self.cursor_fields]
+        return base64.urlsafe_b64encode(
+            json.dumps(values).encode()).decode()
+
     async def _get_item_count(self, query):
+        if self.count_mode == "none":
+            return None
+        if self.count_mode == "estimate":
+            return await self._estimate_item_count(query)
         total_items = await self.db.count(query)
         return total_items
 
-    def _get_list(self, query):
-        return query.paginate(self._get_page(), config.ITEMS_PER_PAGE)
+    async def _estimate_item_count(self, query):
+        """Estimates query rows from table statistics of the planner."""
+        if query._where is None:
+            # Statistics of partitioned tables are kept by partitions
+            table_name = self.model._meta.table_name
+            estimate = await self.db.scalar(self.model.raw(
+                "SELECT SUM(reltuples) FILTER (WHERE reltuples >= 0) "
+                "FROM pg_class WHERE relkind = 'r' AND (oid = %s::regclass "
+                "OR oid IN (SELECT inhrelid FROM pg_inherits "
+                "WHERE inhparent = %s::regclass))", table_name, table_name))
+        else:
+            sql, params = query.order_by().sql()
+            plan = await self.db.scalar(
+                self.model.raw("EXPLAIN (FORMAT JSON) " + sql, *params))
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = plan[0]["Plan"]["Plan Rows"]
+        if estimate is None or estimate < 0:
+            # Table was never analyzed
+            return await self.db.count(query)
+        return int(estimate)
 
-    async def _get_pagination(self, query):
+    def _get_list(self, query):
+        cursor = self._get_cursor()
+        if cursor is None:
+            return query.paginate(self._get_page(), config.ITEMS_PER_PAGE)
+        return self._after_cursor(query, cursor).limit(
+            config.ITEMS_PER_PAGE)
+
+    def _after_cursor(self, query, cursor):
+        """Filters query items following cursor_fields values."""
+        fields = [getattr(self.model, f) for f in self.cursor_fields]
+        return query.where(Tuple(*fields) < Tuple(*cursor))
+
+    async def _get_pagination(self, query, items=None):
         page = self._get_page()
         total_items = await self._get_item_count(query)
+        next_cursor = None
+        if self.cursor_fields and items and (
+                len(items) == config.ITEMS_PER_PAGE):
+            next_cursor = self._make_cursor(items[-1])
         return {"page": page,
                 "total_items": total_items,
+                "count_mode": self.count_mode,
+                "next_cursor": next_cursor,
                 "per_page": config.ITEMS_PER_PAGE}
 
     def _get_filters(self):
@@ -244,6 +334,9 @@ class UniversalController(BaseController):
             options = list(LogType.get_dicts())
         elif key in ["is_admin", "is_active"]:
             options = list(BooleanType.get_dicts())
+        elif key == "module":
+            options = [{"id": j["name"], "label": j["label"]}
+                       for j in AvailableJob.get_dicts()]
 
         return {"key": key,
                 "label": label,
@@ -1,6 +1,3 @@
-import base64
-import hashlib
-
 from constants import LogType, Permission
 from controllers import UniversalController
 from models import User
@@ -20,8 +17,9 @@ class LoginUserController(UniversalController):
         verified_data = self._verify_request_data(("username", "password"))
         user = await self._verify_user(verified_data["username"])
         self.db_log_data["user"] = user
-        self._verify_password(user, verified_data["password"])
-        token_data = await self._login(user)
+        updated_fields = await self._verify_password(
+            user, verified_data["password"])
+        token_data = await self._login(user, updated_fields)
         self.db_log_data["response_data"] = token_data
         return token_data
 
@@ -35,20 +33,25 @@ class LoginUserController(UniversalController):
                 "User %s is disabled" % user.username)
         return user
 
-    def _verify_password(self, user, password):
-        salt = base64.b64decode(user.salt)
-        db_password = base64.b64decode(user.password)
-        hashed_password = hashlib.scrypt(
-            password.encode("utf-8"), salt=salt, n=1024, r=8, p=16)
-        if db_password != hashed_password:
+    async def _verify_password(self, user, password):
+        """Verifies password, returns user fields updated in the process."""
+        password_hasher = self.request.app["password_hasher"]
+        if not await password_hasher.verify(
+                password, user.password, user.salt):
             raise ServiceException(f"User {user.username} password is wrong")
+        # Rehash password made with outdated cost parameters
+        if password_hasher.needs_rehash(user.password):
+            user.password, user.salt = await password_hasher.hash(password)
+            return [User.password, User.salt]
+        return []
 
-    async def _login(self, user):
+    async def _login(self, user, updated_fields=[]):
         if self.auth_class:
             keep_loggged_in = self.request_data["data"].get("keep_logged_in")
             token_data = await self.auth_class._login(
                 user, keep_loggged_in=keep_loggged_in)
-            await self.db.update(user, only=[User.last_login_at])
+            await self.db.update(
+                user, only=[User.last_login_at] + updated_fields)
             return token_data
 
 
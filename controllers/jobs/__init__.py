@@ -1,29 +1,48 @@
-from importlib import import_module
 from datetime import datetime
 
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.util import astimezone, utc_timestamp_to_datetime
 
 import config
 from constants import (LogType, JobTrigger, AvailableJob,
                        trigger_map, BSVariant, Permission)
 from controllers import UniversalController
+from models import APSchedulerJob
 from utils import flash
+from schedulers.executors import is_pool_executor, restart_process_pools
+from schedulers.asyncio_scheduler import NonBlockingAsyncIOScheduler
 from exceptions import ServiceException
 
 
 class BaseJobUniversalController(UniversalController):
-
-    def _job_to_dict(self, job):
-        attrs = ["id", "name", "next_run_time", "kwargs"]
-        job_dict = {}
-        for a in attrs:
-            attr = getattr(job, a, None)
-            if isinstance(attr, datetime):
-                attr = attr.strftime("%Y-%m-%d %H:%M:%S")
-            job_dict[a] = attr
-        return job_dict
+    model = APSchedulerJob
+
+    def _select_query(self):
+        # Job summary columns only, jobs are not restored for listing
+        return self.model.select(
+            self.model.id, self.model.name, self.model.next_run_time,
+            self.model.kwargs, self.model.module, self.model.user_id,
+            self.model.timezone)
+
+    def _order_query(self, q):
+        return q.order_by(self.model.next_run_time.asc(nulls="LAST"),
+                          self.model.id)
+
+    def _summary_to_dict(self, summary):
+        next_run_time = utc_timestamp_to_datetime(summary["next_run_time"])
+        if next_run_time:
+            next_run_time = next_run_time.astimezone(astimezone(
+                summary["timezone"] or config.DEFAULT_TIMEZONE))
+            next_run_time = next_run_time.strftime("%Y-%m-%d %H:%M:%S")
+        return {"id": summary["id"],
+                "name": summary["name"],
+                "next_run_time": next_run_time,
+                "kwargs": summary["kwargs"],
+                "module": summary["module"],
+                "user_id": summary["user_id"],
+                "paused": next_run_time is None}
 
     def _verify_kwargs(self, kwargs):
         if not isinstance(kwargs, dict):
@@ -55,18 +74,54 @@ class BaseJobUniversalController(UniversalController):
         if module not in valid_modules:
             raise ServiceException("Invalid module %s" % module)
 
-    def _verify_job(self, job_id):
-        job = self.request.app["apscheduler"].get_job(job_id)
-        if not job:
+    def _verify_executor(self, executor, module, available_jobs):
+        if not executor:
+            executor = next(j["executor"] for j in available_jobs
+                            if j["name"] == module)
+        if executor not in config.EXECUTORS:
+            raise ServiceException("Invalid executor %s" % executor)
+        return executor
+
+    def _job_func(self, job_module, executor):
+        # Thread and process pool workers can't await coroutine jobs
+        if is_pool_executor(config.EXECUTORS[executor]):
+            return f"{job_module}:APSJob.job_run"
+        return f"{job_module}:APSJob.job_import"
+
+    async def _call_scheduler(self, method, *args, **kwargs):
+        """Calls scheduler method, off the event loop when possible."""
+        scheduler = self.request.app["apscheduler"]
+        if isinstance(scheduler, NonBlockingAsyncIOScheduler):
+            return await scheduler.run_in_db_executor(
+                getattr(scheduler, method), *args, **kwargs)
+        return getattr(scheduler, method)(*args, **kwargs)
+
+    async def _verify_job(self, job_id, restore=True):
+        """Checks job access using job summary.
+
+        Returns restored job, or job summary if restore is not set.
+        """
+        summaries = list(await self.db.execute(
+            self._select_query().where(self.model.id == job_id).dicts()))
+        if not summaries:
             raise ServiceException("Job id %s was not found" % job_id)
-        if not self.user.is_admin and job.args[-1] != self.user.id:
+        summary = summaries[0]
+        if not self.user.is_admin and summary["user_id"] != self.user.id:
             raise ServiceException(
                 "User %s has no access to job id %s" % (
                     self.user.username, job_id))
+        if not restore:
+            return summary
+        job = await self._call_scheduler("get_job", job_id)
+        if not job:
+            raise ServiceException("Job id %s was not found" % job_id)
         return job
 
 
 class JobListController(BaseJobUniversalController):
+    text_filter_names = ("id", "user_id")
+    select_filter_names = ("module",)
+    text_like_filter_names = ("name",)
     required_permissions = [Permission.UserListView.name]
 
     def __init__(self, request):
@@ -75,11 +130,13 @@ class JobListController(BaseJobUniversalController):
         self.save_log = False
 
     async def _call(self):
-        jobs = self.request.app["apscheduler"].get_jobs()
-        jobs = [self._job_to_dict(j)
-                for j in jobs
-                if self.user.is_admin or j.args[-1] == self.user.id]
-        return {"items": jobs, "filters": self._get_filters()}
+        query = self._select_query()
+        if not self.user.is_admin:
+            query = query.where(self.model.user_id == self.user.id)
+        result = await self._filter_query(query)
+        jobs = await self.db.execute(result.dicts())
+        return {"items": [self._summary_to_dict(j) for j in jobs],
+                "filters": self._get_filters()}
 
 
 class JobAddController(BaseJobUniversalController):
@@ -96,6 +153,9 @@ class JobAddController(BaseJobUniversalController):
         valid_modules = [m.get("name") for m in available_jobs]
         job_module = verified_data["module"]
         self._verify_module(job_module, valid_modules)
+        job_executor = self._verify_executor(
+            self.request_data["data"].get("executor"), job_module,
+            available_jobs)
         job_module = "jobs.%s" % job_module
         job_name = verified_data["name"]
         job_id = "__".join([verified_data["module"],
@@ -103,15 +163,17 @@ class JobAddController(BaseJobUniversalController):
         job_kwargs = self._verify_kwargs(verified_data["kwargs"])
         job_trigger = self._verify_trigger(verified_data["trigger"])
 
-        self.request.app["apscheduler"].add_job(
-            f'{job_module}:APSJob.job_import', job_trigger,
+        await self._call_scheduler(
+            "add_job", self._job_func(job_module, job_executor), job_trigger,
             id=job_id,
             name=job_name,
             args=[job_module, job_id, self.user.id],
             kwargs=job_kwargs,
+            executor=job_executor,
             replace_existing=True)
         response_data = {
-            "job_id": job_id, "job_name": job_name, "job_kwargs": job_kwargs}
+            "job_id": job_id, "job_name": job_name, "job_kwargs": job_kwargs,
+            "job_executor": job_executor}
         self.db_log_data["response_data"] = response_data
         flash(self.request, "New job %s has been added" % job_id,
               BSVariant.Success.name, BSVariant.Success.title)
@@ -131,11 +193,12 @@ class JobEditController(BaseJobUniversalController):
         self.required_permissions = required_permissions
 
     async def _call(self, job_id):
-        job = self._verify_job(job_id)
+        job = await self._verify_job(job_id)
         context = {"id": job.id,
                    "name": job.name,
                    "kwargs": job.kwargs,
                    "module": job.args[0].split(".")[-1],
+                   "executor": job.executor,
                    "next_run_time": str(job.next_run_time)}
         if isinstance(job.trigger, CronTrigger):
             for field in job.trigger.fields:
@@ -162,21 +225,26 @@ class JobEditController(BaseJobUniversalController):
         valid_modules = [m.get("name") for m in available_jobs]
         job_module = verified_data["module"]
         self._verify_module(job_module, valid_modules)
+        job_executor = self._verify_executor(
+            self.request_data["data"].get("executor"), job_module,
+            available_jobs)
         job_module = "jobs.%s" % job_module
         job_name = verified_data["name"]
         job_kwargs = self._verify_kwargs(verified_data["kwargs"])
         job_trigger = self._verify_trigger(verified_data["trigger"])
 
-        self.request.app["apscheduler"].add_job(
-            f'{job_module}:APSJob.job_import', job_trigger,
+        await self._call_scheduler(
+            "add_job", self._job_func(job_module, job_executor), job_trigger,
             id=job.id,
             name=job_name,
             args=[job_module, job_id, self.user.id],
             kwargs=job_kwargs,
+            executor=job_executor,
             replace_existing=True,
             next_run_time=job_trigger.start_date or job.next_run_time)
         response_data = {
-            "job_id": job.id, "job_name": job_name, "job_kwargs": job_kwargs}
+            "job_id": job.id, "job_name": job_name, "job_kwargs": job_kwargs,
+            "job_executor": job_executor}
         self.db_log_data["response_data"] = response_data
         flash(self.request, "Job %s has been updated" % job.id,
               BSVariant.Success.name, BSVariant.Success.title)
@@ -203,8 +271,8 @@ class JobDeleteController(BaseJobUniversalController):
             request, LogType.JobDeleteView.id)
 
     async def _call(self, job_id):
-        job = self._verify_job(job_id)
-        job.remove()
+        await self._verify_job(job_id, restore=False)
+        await self._call_scheduler("remove_job", job_id)
         message = "Job %s has been deleted" % job_id
         response_data = {"message": message}
         self.db_log_data["response_data"] = response_data
@@ -221,12 +289,12 @@ class JobPauseController(BaseJobUniversalController):
             request, LogType.JobPauseView.id)
 
     async def _call(self, job_id):
-        job = self._verify_job(job_id)
-        if job.next_run_time:
-            job.pause()
+        summary = await self._verify_job(job_id, restore=False)
+        if summary["next_run_time"] is not None:
+            await self._call_scheduler("pause_job", job_id)
             message = "Job %s has been paused" % job_id
         else:
-            job.resume()
+            await self._call_scheduler("resume_job", job_id)
             message = "Job %s has been resumed" % job_id
         response_data = {"message": message}
         self.db_log_data["response_data"] = response_data
@@ -235,6 +303,30 @@ class JobPauseController(BaseJobUniversalController):
         return response_data
 
 
+class JobReloadController(BaseJobUniversalController):
+    required_permissions = [Permission.JobReloadView.name]
+
+    def __init__(self, request):
+        super(JobReloadController, self).__init__(
+            request, LogType.JobReloadView.id)
+
+    async def _call(self, module):
+        self._verify_module(
+            module, [j["name"] for j in AvailableJob.get_dicts()])
+        try:
+            self.request.app["job_registry"].reload("jobs.%s" % module)
+        except Exception as e:
+            raise ServiceException(
+                "Unable to reload job module %s: %s" % (module, e))
+        restart_process_pools(self.request.app["apscheduler"])
+        message = "Job module %s has been reloaded" % module
+        response_data = {"message": message}
+        self.db_log_data["response_data"] = response_data
+        flash(self.request, message,
+              BSVariant.Success.name, BSVariant.Success.title)
+        return response_data
+
+
 class CommonJobDataController(BaseJobUniversalController):
     related_permissions = [
         Permission.JobAddView.name,
@@ -247,8 +339,11 @@ class CommonJobDataController(BaseJobUniversalController):
     async def _call(self):
         available_jobs = list(AvailableJob.get_dicts())
         job_triggers = list(JobTrigger.get_dicts())
+        job_registry = self.request.app["job_registry"]
         for j in available_jobs:
-            module_name = j["name"]
-            j["job_doc"] = import_module(
-                "jobs.%s" % module_name).APSJob.__doc__
-        return {"job_triggers": job_triggers, "available_jobs": available_jobs}
+            j.update(job_registry.metadata("jobs.%s" % j["name"]))
+        job_executors = [{"name": alias, "label": profile["label"]}
+                         for alias, profile in config.EXECUTORS.items()]
+        return {"job_triggers": job_triggers,
+                "available_jobs": available_jobs,
+                "job_executors": job_executors}
@@ -1,23 +1,28 @@
-import json
+import io
+import csv
 
+from aiohttp import web
+
+import config
 from constants import LogType, Permission
 from controllers import UniversalController
-from utils import convert_types
+from exceptions import ServiceException
+from utils import convert_types, json_dumps
 
 from models import UserLog, JobLog, ErrorLog
 
 
 class BaseLogUniversalController(UniversalController):
     save_log = False
+    count_mode = config.LOG_COUNT_MODE
+    text_like_min_length = config.LOG_SEARCH_CONFIG["min_length"]
 
     def __init__(self, request):
         super(BaseLogUniversalController, self).__init__(
             request, LogType.LogView.id)
 
     async def _call(self):
-        data = await self._process()
-        data["items"] = json.loads(data.get("items"))
-        return data
+        return await self._process()
 
 
 class UserLogController(BaseLogUniversalController):
@@ -27,15 +32,16 @@ class UserLogController(BaseLogUniversalController):
     text_like_filter_names = ("error", "request_data", "response_data",
                               "request_ip", "request_url")
     model = UserLog
+    cursor_fields = ("created_at", "id")
     required_permissions = [Permission.UserLogView.name]
 
     async def _process(self):
         query = self._select_query()
         result = await self._filter_query(query)
         logs = list(await self.db.execute(self._get_list(result).dicts()))
-        pagination = await self._get_pagination(result)
+        pagination = await self._get_pagination(result, logs)
         return {"log_title": "APScron User Logs",
-                "items": json.dumps(logs, default=convert_types),
+                "items": logs,
                 "filters": self._get_filters(),
                 "pagination": pagination}
 
@@ -45,15 +51,16 @@ class JobLogController(BaseLogUniversalController):
     daterange_filter_names = ("started_at", "finished_at")
     text_like_filter_names = ("error", "job_id")
     model = JobLog
+    cursor_fields = ("started_at", "id")
     required_permissions = [Permission.JobLogView.name]
 
     async def _process(self):
         query = self._select_query()
         result = await self._filter_query(query)
         logs = list(await self.db.execute(self._get_list(result).dicts()))
-        pagination = await self._get_pagination(result)
+        pagination = await self._get_pagination(result, logs)
         return {"log_title": "APScron Job Logs",
-                "items": json.dumps(logs, default=convert_types),
+                "items": logs,
                 "filters": self._get_filters(),
                 "pagination": pagination}
 
@@ -64,14 +71,100 @@ class ErrorLogController(BaseLogUniversalController):
     text_like_filter_names = (
         "request_data", "request_ip", "request_url", "error", "traceback")
     model = ErrorLog
+    cursor_fields = ("created_at", "id")
     required_permissions = [Permission.ErrorLogView.name]
 
     async def _process(self):
         query = self._select_query()
         result = await self._filter_query(query)
         logs = list(await self.db.execute(self._get_list(result).dicts()))
-        pagination = await self._get_pagination(result)
+        pagination = await self._get_pagination(result, logs)
         return {"log_title": "APScron Error Logs",
-                "items": json.dumps(logs, default=convert_types),
+                "items": logs,
                 "filters": self._get_filters(),
                 "pagination": pagination}
+
+
+class LogExportMixin(object):
+    """
+    Streams all logs matching the list filters as NDJSON or CSV.
+
+    Logs are read in batches of config.LOG_EXPORT_BATCH_SIZE, each one
+    continuing after the last log of the previous batch like list cursors
+    do, and written to the response as they are read, so memory use
+    doesn't depend on the amount of exported logs.
+    """
+    export_formats = {"ndjson": "application/x-ndjson",
+                      "csv": "text/csv"}
+
+    async def _call(self):
+        export_format = self.request.query.get("format", "ndjson")
+        if export_format not in self.export_formats:
+            raise ServiceException(
+                "Invalid export format %s" % export_format)
+        query = await self._filter_query(self._select_query())
+        response = web.StreamResponse(headers={
+            "Content-Disposition": "attachment; filename=%s.%s" % (
+                self.model._meta.table_name, export_format)})
+        response.content_type = self.export_formats[export_format]
+        response.charset = "utf-8"
+        await response.prepare(self.request)
+        try:
+            if export_format == "csv":
+                await response.write(self._to_csv([self._get_columns()]))
+            async for logs in self._iter_batches(query):
+                if export_format == "csv":
+                    columns = self._get_columns()
+                    data = self._to_csv(
+                        [[self._to_csv_value(log[c]) for c in columns]
+                         for log in logs])
+                else:
+                    data = b"".join(
+                        json_dumps(log) + b"\n" for log in logs)
+                await response.write(data)
+        except Exception:
+            # Headers are sent already, the client gets a truncated export
+            self.log.exception("%s export failed" % self.class_name)
+            response.force_close()
+        return response
+
+    async def _iter_batches(self, query):
+        batch_size = config.LOG_EXPORT_BATCH_SIZE
+        cursor = None
+        while True:
+            batch_query = query if cursor is None else self._after_cursor(
+                query, cursor)
+            logs = list(await self.db.execute(
+                batch_query.limit(batch_size).dicts()))
+            if logs:
+                yield logs
+            if len(logs) < batch_size:
+                return
+            cursor = [logs[-1][f] for f in self.cursor_fields]
+
+    def _get_columns(self):
+        return [f.name for f in self.model._meta.sorted_fields]
+
+    def _to_csv(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode("utf-8")
+
+    def _to_csv_value(self, value):
+        if isinstance(value, (dict, list)):
+            return json_dumps(value).decode("utf-8")
+        if value is None or isinstance(value, (str, int, float)):
+            return value
+        return convert_types(value)
+
+
+class UserLogExportController(LogExportMixin, UserLogController):
+    pass
+
+
+class JobLogExportController(LogExportMixin, JobLogController):
+    pass
+
+
+class ErrorLogExportController(LogExportMixin, ErrorLogController):
+    pass
@@ -1,13 +1,9 @@
-import os
-import json
-import base64
-import hashlib
 import ipaddress
 
 from constants import LogType, Permission, BSVariant
 from controllers import UniversalController
 from models import User
-from utils import flash, convert_types
+from utils import flash
 from exceptions import ServiceException
 
 
@@ -38,6 +34,11 @@ class BaseUserController(UniversalController):
             raise ServiceException(f"User with id {id_} was not found")
         return user
 
+    def _invalidate_cached_user(self, user):
+        user_cache = self.request.app.get("user_cache")
+        if user_cache is not None:
+            user_cache.pop(user.id)
+
 
 class UserListController(BaseUserController):
     text_filter_names = ("id",)
@@ -55,11 +56,9 @@ class UserListController(BaseUserController):
     async def _call(self):
         query = self._select_query()
         result = await self._filter_query(query)
-        users = json.dumps(
-            list(await self.db.execute(self._get_list(result).dicts())),
-            default=convert_types)
+        users = list(await self.db.execute(self._get_list(result).dicts()))
         pagination = await self._get_pagination(result)
-        return {"items": json.loads(users),
+        return {"items": users,
                 "filters": self._get_filters(),
                 "pagination": pagination}
 
@@ -85,7 +84,8 @@ class UserAddController(BaseUserController):
         verified_data = self._verify_request_data(
             ("username", "password", "ip_list"))
         username = await self._verify_username(verified_data["username"])
-        password, salt = self._verify_password(verified_data["password"])
+        password, salt = await self._verify_password(
+            verified_data["password"])
         ip_list = self._validate_ip_list(verified_data["ip_list"])
         gauth = self.request_data["data"].get("gauth")
         permissions = await self._verify_permissions()
@@ -106,17 +106,11 @@ class UserAddController(BaseUserController):
               BSVariant.Success.name, BSVariant.Success.title)
         return response_data
 
-    def _verify_password(self, password):
+    async def _verify_password(self, password):
         if not password:
             raise ServiceException("Specify password")
 
-        salt = os.urandom(128)
-        password = base64.b64encode(
-            hashlib.scrypt(str(password).encode("utf-8"),
-                           salt=salt, n=1024, r=8, p=16))
-        salt = base64.b64encode(salt)
-
-        return password, salt
+        return await self.request.app["password_hasher"].hash(password)
 
     async def _verify_username(self, username):
         if not username:
@@ -159,7 +153,7 @@ class UserEditController(BaseUserController):
         verified_data = self._verify_request_data(("username", "ip_list"))
         user.username = await self._verify_username(
             user.username, verified_data["username"])
-        password, salt = self._verify_password(
+        password, salt = await self._verify_password(
             self.request_data["data"].get("password"))
         user.ip_list = self._validate_ip_list(verified_data["ip_list"])
         gauth = self.request_data["data"].get("gauth")
@@ -174,6 +168,7 @@ class UserEditController(BaseUserController):
             user.gauth = gauth
 
         await self.db.update(user)
+        self._invalidate_cached_user(user)
         response_data = {
             "id": user.id, "username": user.username,
             "permissions": user.permissions, "is_admin": user.is_admin,
@@ -183,15 +178,9 @@ class UserEditController(BaseUserController):
               BSVariant.Success.name, BSVariant.Success.title)
         return response_data
 
-    def _verify_password(self, password):
+    async def _verify_password(self, password):
         if password:
-            salt = os.urandom(128)
-            password = base64.b64encode(
-                hashlib.scrypt(str(password).encode("utf-8"),
-                               salt=salt, n=1024, r=8, p=16))
-            salt = base64.b64encode(salt)
-
-            return password, salt
+            return await self.request.app["password_hasher"].hash(password)
 
         return None, None
 
@@ -218,6 +207,7 @@ class UserDeleteController(BaseUserController):
     async def _call(self, user_id):
         user = await self._verify_user(user_id)
         await self.db.delete(user)
+        self._invalidate_cached_user(user)
         message = "User %s has been deleted" % user.username
         response_data = {"message": message}
         self.db_log_data["response_data"] = response_data
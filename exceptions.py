@@ -28,3 +28,8 @@ class AuthorizationException(HandledException):
 class MethodNotAllowedException(HandledException):
     error_message = "Method Not Allowed"
     error_status = HTTPStatus.METHOD_NOT_ALLOWED.value
+
+
+class NotFoundException(HandledException):
+    error_message = "Not Found"
+    error_status = HTTPStatus.NOT_FOUND.value
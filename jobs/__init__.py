@@ -1,11 +1,21 @@
 import os
+import asyncio
 import traceback
 from datetime import datetime
-from importlib import import_module
+from functools import partial
+from contextlib import asynccontextmanager
+from threading import Lock
+from importlib import import_module, reload
+
+import aiohttp_jinja2
+from aiohttp import ClientSession
 
 import config
+from constants import AvailableJob
 from models import JobLog, async_db_manager
-from utils import get_log
+from utils import get_log, create_template_env
+from clients import DNSResolver
+from jobs.job_utils import build_email, send_email
 
 
 log = get_log(os.path.join(config.DIRS["LOG_TO"], config.LOGGER["file"]),
@@ -16,21 +26,110 @@ class JobException(Exception):
     pass
 
 
-class BaseJobController(object):
+class JobRegistry(object):
+    """
+    Job classes of job modules, resolved once and reused by every run.
+
+    Modules are keyed by their import path (e.g. "jobs.test_job"), as passed
+    to jobs in args[0]. Modules not loaded at startup (e.g. in worker
+    processes) are imported on first use.
+    """
 
     def __init__(self):
+        self._jobs = {}
+        self._lock = Lock()
+
+    def load(self, job_modules):
+        for job_module in job_modules:
+            self.get(job_module)
+
+    def get(self, job_module):
+        """Gets job class of the module."""
+        job_class = self._jobs.get(job_module)
+        if job_class is None:
+            with self._lock:
+                job_class = self._jobs.get(job_module)
+                if job_class is None:
+                    job_class = getattr(import_module(job_module), "APSJob")
+                    self._jobs[job_module] = job_class
+        return job_class
+
+    def reload(self, job_module):
+        """Re-imports job module, next runs use the reloaded job class.
+
+        Only the registry of this process is reloaded, process pool
+        executors have to be restarted for their workers to import the
+        module again, see schedulers.executors.restart_process_pools.
+        """
+        with self._lock:
+            module = reload(import_module(job_module))
+            self._jobs[job_module] = getattr(module, "APSJob")
+        return self._jobs[job_module]
+
+    def metadata(self, job_module):
+        return {"job_doc": self.get(job_module).__doc__}
+
+
+job_registry = JobRegistry()
+
+
+async def _import_and_call(args, kwargs, run_in_worker=False):
+    try:
+        job_class = job_registry.get(args[0])
+        await job_class(run_in_worker=run_in_worker).call(*args, **kwargs)
+    except Exception as e:
+        log.exception(e)
+
+
+_report_env = None
+
+
+def get_report_env(app=None):
+    """Gets jinja environment job reports are rendered with.
+
+    The application environment is used when available, jobs run in
+    worker processes share one environment per process.
+    """
+    global _report_env
+    env = aiohttp_jinja2.get_env(app) if app is not None else None
+    if env is not None:
+        return env
+    if _report_env is None:
+        _report_env = create_template_env()
+    return _report_env
+
+
+def setup_jobs(app):
+    """Gives jobs access to objects shared by the application
+    and loads available job modules.
+    """
+    BaseJobController.app = app
+    job_registry.load("jobs.%s" % j["name"] for j in AvailableJob.get_dicts())
+    app["job_registry"] = job_registry
+
+
+class BaseJobController(object):
+    app = None
+
+    def __init__(self, run_in_worker=False):
         self.log_model = JobLog
         self.job_result = {}
         self.log = log
         self.db = async_db_manager
+        # Jobs run by thread and process pool executors get their own
+        # event loop, async database manager only works on the main one
+        self.run_in_worker = run_in_worker
+        if not run_in_worker and self.app and "dns_resolver" in self.app:
+            self.dns_resolver = self.app["dns_resolver"]
+        else:
+            self.dns_resolver = DNSResolver()
 
     async def job_import(*args, **kwargs):
-        try:
-            job_module = import_module(args[0])
-            job_class = getattr(job_module, "APSJob")
-            await job_class().call(*args, **kwargs)
-        except Exception as e:
-            log.exception(e)
+        await _import_and_call(args, kwargs)
+
+    def job_run(*args, **kwargs):
+        """Runs job in a thread or process pool worker."""
+        asyncio.run(_import_and_call(args, kwargs, run_in_worker=True))
 
     async def call(self, *args, **kwargs):
         job_id = args[1]
@@ -58,11 +157,62 @@ class BaseJobController(object):
         finally:
             if not self.db_log_data.get("finished_at"):
                 self.db_log_data["finished_at"] = datetime.now()
-            await self.db.create(self.log_model, **self.db_log_data)
+            await self._save_log()
+
+    async def _save_log(self):
+        if not self.run_in_worker:
+            log_writers = self.app.get("log_writers", {}) if self.app else {}
+            if self.log_model in log_writers:
+                await log_writers[self.log_model].write(**self.db_log_data)
+            else:
+                await self.db.create(self.log_model, **self.db_log_data)
+            return
+        with self.log_model._meta.database.connection_context():
+            self.log_model.create(**self.db_log_data)
 
     def _call(self, *args, **kwargs):
         raise NotImplementedError("_call")
 
+    @asynccontextmanager
+    async def http_session(self, name="default"):
+        """Yields shared HTTP client session.
+
+        Jobs run by pool executors get a session of their own,
+        closed once the job is done.
+        """
+        if (not self.run_in_worker and self.app
+                and "client_sessions" in self.app):
+            yield self.app["client_sessions"].get(name)
+            return
+        async with ClientSession() as session:
+            yield session
+
+    def render_report(self, template_name, **context):
+        """Renders job report from templates/reports folder."""
+        template = get_report_env(self.app).get_template(
+            "reports/%s" % template_name)
+        return template.render(**context)
+
+    async def send_email(self, subject, text, dest_to, attachments=[],
+                         is_html=False):
+        """Sends email from config.SMTP_USER.
+
+        Jobs run on the application event loop use the shared mailer,
+        jobs run by pool executors and jobs of applications without one
+        connect to SMTP server on their own, in a thread of the default
+        executor.
+        """
+        if self.run_in_worker or not self.app or "mailer" not in self.app:
+            await asyncio.get_event_loop().run_in_executor(None, partial(
+                send_email, subject, text, config.SMTP_USER, dest_to,
+                config.SMTP_HOST, config.SMTP_PORT, config.SMTP_USER,
+                config.SMTP_PASSWORD, attachments=attachments,
+                is_html=is_html))
+            return
+        message = build_email(subject, text, config.SMTP_USER, dest_to,
+                              attachments=attachments, is_html=is_html)
+        await self.app["mailer"].send(message, config.SMTP_USER, dest_to)
+
     def _verify_job_kwargs(self, kwargs, required_keys):
         for key in required_keys:
             if not kwargs.get(key):
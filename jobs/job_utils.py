@@ -1,4 +1,7 @@
 import os
+import time
+import asyncio
+import collections
 import smtplib
 from email import encoders
 from email.mime.base import MIMEBase
@@ -7,9 +10,12 @@ from email.mime.multipart import MIMEMultipart
 from email.utils import COMMASPACE, formatdate
 
 
-def send_email(subject, text, send_from, dest_to,
-               server, port, user, password, attachments=[],
-               is_html=False):
+_nothing = object()
+
+
+def build_email(subject, text, send_from, dest_to, attachments=[],
+                is_html=False):
+    """Builds email message with optional file attachments."""
     message = MIMEMultipart()
     message["Subject"] = subject
     message["From"] = send_from
@@ -29,7 +35,15 @@ def send_email(subject, text, send_from, dest_to,
             "content-disposition", "attachment",
             filename=os.path.basename(attachment_path))
         message.attach(attachment)
+    return message
 
+
+def send_email(subject, text, send_from, dest_to,
+               server, port, user, password, attachments=[],
+               is_html=False):
+    """Sends email over a new blocking SMTP connection."""
+    message = build_email(subject, text, send_from, dest_to,
+                          attachments=attachments, is_html=is_html)
     smtp_server = None
     try:
         smtp_server = smtplib.SMTP(host=server, port=port, timeout=3)
@@ -41,3 +55,69 @@ def send_email(subject, text, send_from, dest_to,
     finally:
         if smtp_server:
             smtp_server.quit()
+
+
+async def bounded_fan_out(items, func, max_concurrency=100, key=None,
+                          max_per_key=None):
+    """Runs func(item) coroutine for every item with bounded concurrency.
+
+    At most max_concurrency calls run at once and, if key is given, at most
+    max_per_key calls share the same key(item). Yields (item, result,
+    seconds) tuples as calls complete, result being the raised exception
+    for failed calls and seconds the call duration.
+    """
+    items = iter(items)
+    max_concurrency = max(1, int(max_concurrency))
+    # Items whose key is busy wait here, so calls for other keys
+    # are not held up behind them
+    deferred = collections.deque()
+    max_deferred = max_concurrency * 10
+    running_per_key = collections.Counter()
+    tasks = {}
+
+    def is_allowed(item):
+        return (key is None or not max_per_key
+                or running_per_key[key(item)] < max_per_key)
+
+    def take():
+        for _ in range(len(deferred)):
+            item = deferred.popleft()
+            if is_allowed(item):
+                return item
+            deferred.append(item)
+        while len(deferred) < max_deferred:
+            item = next(items, _nothing)
+            if item is _nothing or is_allowed(item):
+                return item
+            deferred.append(item)
+        return _nothing
+
+    async def call(item):
+        started_at = time.monotonic()
+        try:
+            result = await func(item)
+        except Exception as e:
+            result = e
+        return item, result, time.monotonic() - started_at
+
+    try:
+        while True:
+            while len(tasks) < max_concurrency:
+                item = take()
+                if item is _nothing:
+                    break
+                if key is not None:
+                    running_per_key[key(item)] += 1
+                tasks[asyncio.ensure_future(call(item))] = item
+            if not tasks:
+                break
+            done, _ = await asyncio.wait(
+                set(tasks), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                item = tasks.pop(task)
+                if key is not None:
+                    running_per_key[key(item)] -= 1
+                yield task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
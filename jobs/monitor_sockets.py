@@ -1,14 +1,11 @@
-import socket
 import asyncio
 from datetime import datetime
 
-from jinja2 import Template
-from aiohttp import ClientSession, ClientTimeout
+from aiohttp import ClientTimeout
 from aiohttp.client_exceptions import ClientError
 
-import config
 from jobs import BaseJobController
-from jobs.job_utils import send_email
+from jobs.job_utils import bounded_fan_out
 
 
 class APSJob(BaseJobController):
@@ -40,6 +37,10 @@ class APSJob(BaseJobController):
     Amount of seconds allowed to fetch a single URL.
     Default is 30. Do not set too low timeout, as it will result in connect
     timeout error.<br>
+    <b>max_concurrency</b> - Optional. Maximum amount of requests sent
+    at once. Default is 100.<br>
+    <b>max_per_host</b> - Optional. Maximum amount of requests sent
+    to a single host at once. Default is 10.<br>
     </div>
     """
 
@@ -52,74 +53,61 @@ class APSJob(BaseJobController):
         else:
             timeout = float(30)
 
-        tasks = []
-        request_urls = []
-        async with ClientSession(
-                timeout=ClientTimeout(total=timeout)) as session:
-            for host in kwargs.get("hosts"):
-                for ut in kwargs.get("url_templates"):
-                    url = ut % host
-                    tasks.append(self.send_request(session, "GET", host, url))
-                    request_urls.append(url)
-            result = await asyncio.gather(*tasks, return_exceptions=True)
-            await session.close()
+        max_concurrency = int(kwargs.get("max_concurrency") or 100)
+        max_per_host = int(kwargs.get("max_per_host") or 10)
+
+        checks = ((host, ut % host) for host in kwargs.get("hosts")
+                  for ut in kwargs.get("url_templates"))
+        timeout = ClientTimeout(total=timeout)
         failed_resp = []
+        latency = {}
+        async with self.http_session() as session:
+            results = bounded_fan_out(
+                checks,
+                lambda check: self.send_request(
+                    session, "GET", check[0], check[1], timeout),
+                max_concurrency=max_concurrency,
+                key=lambda check: check[0],
+                max_per_key=max_per_host)
+            async for (host, url), item, seconds in results:
+                latency[url] = round(seconds, 3)
+                if isinstance(item, (ClientError, asyncio.TimeoutError)):
+                    failed_resp.append(
+                        {"url": url,
+                         "error": " ".join(
+                             [item.__class__.__name__, str(item)])})
+                elif isinstance(item, dict) and item.get("status") != 200:
+                    failed_resp.append(item)
         subject = "APSCron Monitor Socket %s" % datetime.now().strftime(
             "%Y-%m-%d %H:%M:%S")
-        j_template = Template("""
-        <html>
-        <head><title>{{ subject }}</title></head>
-        <body>
-        {% for item in failed_resp %}
-        {% if item.get("error") %}
-        <div>
-            <p>
-                <b>Request URL:</b>
-                <a href="{{ item.get("url") }}">{{ item.get("url") }}</a>
-            </p>
-            <p>
-                <b>Error:</b> {{ item.get("error") }}
-            </p>
-        </div>
-        {% else %}
-        <div>
-            <p>
-                <b>Request URL:</b>
-                <a href="{{ item.get("url") }}">{{ item.get("url") }}</a>
-            </p>
-            <p><b>Request Method:</b> {{ item.get("method") }}</p>
-            <p>
-                <b>Status Code:</b>
-                {{item.get("status")}} {{item.get("status_text")}}
-            </p>
-            <p><b>Remote Address:</b> {{item.get("ip")}}</p>
-        </div>
-        {% endif %}
-        <hr>
-        {% endfor %}
-        </body>
-        </html>
-        """)
-        for index, item in enumerate(result):
-            if isinstance(item, ClientError):
-                failed_resp.append(
-                    {"url": request_urls[index],
-                     "error": " ".join([item.__class__.__name__, str(item)])})
-            elif isinstance(item, dict) and item.get("status") != 200:
-                failed_resp.append(item)
         self.job_result["result"] = failed_resp
+        self.job_result["latency"] = latency
         if failed_resp:
-            html = j_template.render(subject=subject, failed_resp=failed_resp)
-            send_email(subject, html, config.SMTP_USER, to_emails,
-                       config.SMTP_HOST, config.SMTP_PORT, config.SMTP_USER,
-                       config.SMTP_PASSWORD, is_html=True)
+            html = self.render_report(
+                "monitor_sockets.html", subject=subject,
+                failed_resp=failed_resp)
+            await self.send_email(subject, html, to_emails, is_html=True)
         self.db_log_data["finished_at"] = datetime.now()
 
-    async def send_request(self, session, method, host, url):
-        resp = await session.request(method, url)
-        try:
-            ip = socket.gethostbyname(host)
-        except Exception:
-            ip = "Failed to resolve IP"
+    async def send_request(self, session, method, host, url, timeout):
+        async with session.request(method, url, timeout=timeout) as resp:
+            ip = self._get_peer_ip(resp)
+            # Connection only goes back to the pool once body is read
+            await resp.read()
+        if ip and resp.url.host == host:
+            self.dns_resolver.remember(host, ip)
+        else:
+            # Redirected to another host, report address of the checked one
+            try:
+                ip = await self.dns_resolver.resolve(host)
+            except OSError:
+                ip = "Failed to resolve IP"
         return {"status": resp.status, "status_text": resp.reason,
                 "url": url, "ip": ip, "method": method}
+
+    def _get_peer_ip(self, resp):
+        # Address the response actually came from, no lookup needed
+        if resp.connection is None or resp.connection.transport is None:
+            return None
+        peername = resp.connection.transport.get_extra_info("peername")
+        return peername[0] if peername else None
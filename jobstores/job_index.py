@@ -0,0 +1,87 @@
+import heapq
+from threading import RLock
+
+
+class JobIndex(object):
+    """
+    In-memory index of jobs ordered by next run time.
+
+    Jobs are kept in an id -> (job, timestamp) dict and scheduled jobs are
+    also pushed to a heap of (timestamp, job_id) entries. Heap entries are
+    invalidated lazily: an entry is only valid while its timestamp matches
+    the one currently stored for the job, stale entries are dropped once
+    they reach the top of the heap.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._heap = []
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __contains__(self, job_id):
+        return job_id in self._jobs
+
+    def get(self, job_id):
+        entry = self._jobs.get(job_id)
+        return entry[0] if entry else None
+
+    def get_all(self):
+        with self._lock:
+            entries = sorted(
+                self._jobs.values(),
+                key=lambda e: (e[1] is None, e[1] or 0))
+        return [job for job, timestamp in entries]
+
+    def add(self, job, timestamp):
+        """Adds job to index, replaces the job with the same id if any."""
+        with self._lock:
+            self._jobs[job.id] = (job, timestamp)
+            if timestamp is not None:
+                heapq.heappush(self._heap, (timestamp, job.id))
+            if len(self._heap) > 2 * len(self._jobs) + 100:
+                self._rebuild_heap()
+
+    def remove(self, job_id):
+        with self._lock:
+            return self._jobs.pop(job_id, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._jobs.clear()
+            self._heap.clear()
+
+    def get_next_run_time(self):
+        """Returns the earliest next run timestamp or None."""
+        with self._lock:
+            while self._heap and not self._is_valid(self._heap[0]):
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def get_due(self, timestamp):
+        """Returns jobs due at timestamp ordered by next run time."""
+        with self._lock:
+            entries = []
+            job_ids = set()
+            while self._heap and self._heap[0][0] <= timestamp:
+                entry = heapq.heappop(self._heap)
+                if self._is_valid(entry) and entry[1] not in job_ids:
+                    entries.append(entry)
+                    job_ids.add(entry[1])
+            # Due jobs stay in the index until they are updated or removed
+            for entry in entries:
+                heapq.heappush(self._heap, entry)
+            return [self._jobs[job_id][0] for _, job_id in entries]
+
+    def _is_valid(self, entry):
+        timestamp, job_id = entry
+        job_entry = self._jobs.get(job_id)
+        return job_entry is not None and job_entry[1] == timestamp
+
+    def _rebuild_heap(self):
+        self._heap = [(timestamp, job_id)
+                      for job_id, (job, timestamp) in self._jobs.items()
+                      if timestamp is not None]
+        heapq.heapify(self._heap)
@@ -0,0 +1,90 @@
+import json
+import asyncio
+import logging
+
+import aiopg
+
+
+class JobChangesListener(object):
+    """
+    Listens to job changes made by other apscron nodes.
+
+    PeeweeJobStore with notify_channel set NOTIFYs the channel on every
+    job added, changed or removed. The listener LISTENs on a dedicated
+    connection, invalidates changed jobs in the job store cache and wakes
+    the scheduler up, so new jobs are picked up without waiting for the
+    next computed wakeup.
+    """
+
+    def __init__(self, scheduler, jobstore, database,
+                 reconnect_interval=5, wakeup_delay=0.05):
+        self.scheduler = scheduler
+        self.jobstore = jobstore
+        self.database = database
+        self.reconnect_interval = reconnect_interval
+        # Bursts of notifications are handled with a single wakeup
+        self.wakeup_delay = wakeup_delay
+        self.log = logging.getLogger("apscheduler.listener")
+        self._task = None
+        self._wakeup_handle = None
+        self._reconnected = False
+
+    async def start(self):
+        self._task = asyncio.get_event_loop().create_task(self._listen())
+
+    async def close(self):
+        if self._wakeup_handle:
+            self._wakeup_handle.cancel()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _listen(self):
+        while True:
+            try:
+                async with aiopg.connect(
+                        database=self.database.database,
+                        enable_hstore=False,
+                        **self.database.connect_params) as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(
+                            'LISTEN "%s"' % self.jobstore.notify_channel)
+                    self.log.info("Listening to %s",
+                                  self.jobstore.notify_channel)
+                    # Changes made while disconnected are not delivered
+                    if self._reconnected:
+                        self._handle_change(None)
+                    self._reconnected = True
+                    while True:
+                        notify = await conn.notifies.get()
+                        self._handle_notify(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.log.exception(
+                    "Job changes listener failed, reconnecting in %s s",
+                    self.reconnect_interval)
+                await asyncio.sleep(self.reconnect_interval)
+
+    def _handle_notify(self, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            self.log.warning("Invalid job change notification %s", payload)
+            return
+        if data.get("node_id") == self.jobstore.node_id:
+            return
+        self._handle_change(data.get("job_id"))
+
+    def _handle_change(self, job_id):
+        self.jobstore.invalidate_job(job_id)
+        if not self._wakeup_handle:
+            self._wakeup_handle = asyncio.get_event_loop().call_later(
+                self.wakeup_delay, self._wakeup)
+
+    def _wakeup(self):
+        self._wakeup_handle = None
+        self.scheduler.wakeup()
@@ -1,4 +1,8 @@
 from __future__ import absolute_import
+import os
+import json
+import socket
+import threading
 try:
     import cPickle as pickle
 except ImportError:  # pragma: nocover
@@ -10,10 +14,19 @@ from apscheduler.jobstores.base import ConflictingIdError
 from apscheduler.util import datetime_to_utc_timestamp
 from apscheduler.util import utc_timestamp_to_datetime
 from apscheduler.job import Job
+from apscheduler.events import (EVENT_JOB_EXECUTED, EVENT_JOB_ERROR,
+                                EVENT_JOB_MISSED)
 
-from peewee import IntegrityError
+from peewee import IntegrityError, ValuesList, Case, fn
 
-from models import APSchedulerJob
+from models import APSchedulerJob, migrate_table
+from jobstores.job_index import JobIndex
+from jobstores.serializers import (encode_job_state, decode_job_state,
+                                   restore_next_run_time, trigger_zone,
+                                   is_json_safe)
+
+
+COMPACT_COLUMNS = ("func", "trigger", "args", "kwargs", "job_options")
 
 
 class PeeweeJobStore(BaseJobStore):
@@ -23,33 +36,134 @@ class PeeweeJobStore(BaseJobStore):
 
     :param int pickle_protocol: pickle protocol level to use
         (for serialization), defaults to the highest available
+    :param bool cache_jobs: keep all jobs in memory and answer reads from
+        there, the table is only written to (write-through). Only safe when
+        this process is the only writer of the jobs table or when jobs
+        changed by other writers are reported via invalidate_job
+    :param bool batch_updates: collect update_job calls made while due jobs
+        are processed and write them with a single multi-row UPDATE
+        when the scheduler asks for the next run time
+    :param int batch_size: maximum amount of rows per UPDATE statement
+    :param bool compact_state: store static job definition in separate JSON
+        columns instead of a pickled job state (see jobstores.serializers).
+        Either way, updates which only move next run time write
+        the next_run_time column only
+    :param str notify_channel: Postgres channel to NOTIFY about added,
+        changed and removed jobs, see jobstores.listener
+    :param bool claim_jobs: claim due jobs with SELECT ... FOR UPDATE
+        SKIP LOCKED, so every due job is run by one of the nodes sharing
+        the table only. Claimed job is leased to this node until its run
+        finishes or the lease expires. Can't be used with cache_jobs
+    :param int lease_seconds: time after which jobs claimed by a node
+        which didn't release them (e.g. died) can be claimed again
+    :param int claim_limit: maximum amount of jobs claimed per wakeup,
+        None for no limit
     """
 
     def __init__(self, pickle_protocol=pickle.HIGHEST_PROTOCOL,
-                 jobs_t=APSchedulerJob):
+                 jobs_t=APSchedulerJob, cache_jobs=False,
+                 batch_updates=False, batch_size=500, compact_state=False,
+                 notify_channel=None, claim_jobs=False, lease_seconds=300,
+                 claim_limit=None):
         super(PeeweeJobStore, self).__init__()
+        if claim_jobs and cache_jobs:
+            raise ValueError("claim_jobs can't be used with cache_jobs")
+        self.claim_jobs = claim_jobs
+        self.lease_seconds = lease_seconds
+        self.claim_limit = claim_limit
+        self.notify_channel = notify_channel
+        self.node_id = "%s:%s" % (socket.gethostname(), os.getpid())
+        # Ids of jobs changed by other nodes, reloaded into the index
+        # before it is read next time. Added by the listener in the event
+        # loop while the scheduler may read the index in a worker thread
+        self._stale_job_ids = set()
+        self._stale_lock = threading.Lock()
+        # Ids of claimed jobs whose run finished, released on next claim.
+        # Added by executors when jobs finish
+        self._finished_job_ids = set()
+        self._finished_lock = threading.Lock()
         self.pickle_protocol = pickle_protocol
+        self.compact_state = compact_state
+        # Static definitions of known jobs, used to detect which updates
+        # only change next run time
+        self._definitions = {}
 
         self.jobs_t = jobs_t
+        self._index = JobIndex() if cache_jobs else None
+        self.batch_updates = batch_updates
+        self.batch_size = batch_size
+        self._batching = False
+        self._due_job_ids = set()
+        self._pending_updates = {}
 
     def start(self, scheduler, alias):
         super(PeeweeJobStore, self).start(scheduler, alias)
         if self.jobs_t._meta.database.is_closed():
             self.jobs_t._meta.database.connect()
         self.jobs_t.create_table(safe=True)
+        migrate_table(self.jobs_t)
+        self._fill_summaries()
+        if self.claim_jobs:
+            scheduler.add_listener(
+                self._job_finished,
+                EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+        if self._index is not None:
+            self._index.clear()
+            for job in self._get_jobs():
+                self._index.add(
+                    job, datetime_to_utc_timestamp(job.next_run_time))
 
     def lookup_job(self, job_id):
+        if self._index is not None:
+            self._refresh_stale_jobs()
+            return self._index.get(job_id)
+        self._flush_updates()
         res = (self.jobs_t
-               .select(self.jobs_t.job_state)
+               .select()
                .where(self.jobs_t.id == job_id)
                .first())
-        return self._reconstitute_job(res.job_state) if res else None
+        return self._reconstitute_job(res) if res else None
 
     def get_due_jobs(self, now):
         timestamp = datetime_to_utc_timestamp(now)
-        return self._get_jobs(self.jobs_t.next_run_time <= timestamp)
+        # Scheduler updates every due job and then asks for the next run
+        # time, updates made in between are written in one go
+        self._flush_updates()
+        if self._pending_updates and self._index is None:
+            # Due jobs read from the table would be run again
+            raise RuntimeError("Unable to write %s job updates" %
+                               len(self._pending_updates))
+        if self._index is not None:
+            self._refresh_stale_jobs()
+            jobs = self._index.get_due(timestamp)
+        elif self.claim_jobs:
+            jobs = self._claim_due_jobs(timestamp)
+        else:
+            jobs = self._get_jobs(self.jobs_t.next_run_time <= timestamp)
+        self._due_job_ids = {job.id for job in jobs}
+        self._batching = self.batch_updates
+        return jobs
 
     def get_next_run_time(self):
+        self._flush_updates()
+        # Scheduler is done with the due jobs
+        self._due_job_ids = set()
+        if self._index is not None:
+            self._refresh_stale_jobs()
+            return utc_timestamp_to_datetime(self._index.get_next_run_time())
+        if self.claim_jobs:
+            # Jobs leased to other nodes are due for this node only
+            # if their lease expires before their run finishes
+            next_run_time = Case(None, (
+                (self.jobs_t.lease_owner == self.node_id,
+                 self.jobs_t.next_run_time),), fn.GREATEST(
+                    self.jobs_t.next_run_time,
+                    fn.COALESCE(self.jobs_t.lease_expires_at, 0)))
+            timestamp = (self.jobs_t
+                         .select(fn.MIN(next_run_time))
+                         .where(self.jobs_t.next_run_time.is_null(False))
+                         .scalar())
+            return utc_timestamp_to_datetime(timestamp)
         res = (self.jobs_t
                .select(self.jobs_t.next_run_time)
                .where(self.jobs_t.next_run_time.is_null(False))
@@ -58,50 +172,237 @@ class PeeweeJobStore(BaseJobStore):
         return utc_timestamp_to_datetime(res.next_run_time) if res else None
 
     def get_all_jobs(self):
+        if self._index is not None:
+            self._refresh_stale_jobs()
+            return self._index.get_all()
+        self._flush_updates()
         jobs = self._get_jobs()
         self._fix_paused_jobs_sorting(jobs)
         return jobs
 
     def add_job(self, job):
+        if self._index is not None and job.id in self._index:
+            raise ConflictingIdError(job.id)
+        self._flush_updates()
+        next_run_time = datetime_to_utc_timestamp(job.next_run_time)
+        state = job.__getstate__()
         try:
             (self.jobs_t
                 .insert(
                     id=job.id,
-                    next_run_time=datetime_to_utc_timestamp(job.next_run_time),
-                    job_state=pickle.dumps(
-                        job.__getstate__(), self.pickle_protocol))
+                    next_run_time=next_run_time,
+                    **self._serialize_job(state))
                 .execute())
         except IntegrityError:
             raise ConflictingIdError(job.id)
+        self._remember_definition(job.id, state)
+        if self._index is not None:
+            self._index.add(job, next_run_time)
+        self._notify(job.id)
 
     def update_job(self, job):
-        res = (self.jobs_t
-               .update(next_run_time=datetime_to_utc_timestamp(
-                       job.next_run_time),
-                       job_state=pickle.dumps(
-                       job.__getstate__(), self.pickle_protocol))
-               .where(self.jobs_t.id == job.id)
-               .execute())
-        if res == 0:
-            raise JobLookupError(job.id)
+        next_run_time = datetime_to_utc_timestamp(job.next_run_time)
+        state = job.__getstate__()
+        # Scheduler only moves next run time of processed jobs,
+        # serialize the rest of the job only when it has changed
+        fields = {}
+        if self._remember_definition(job.id, state):
+            fields = self._serialize_job(state)
+        # Due jobs are updated by the scheduler, other nodes compute the
+        # same next run time, so only changed definitions are notified.
+        # Jobs modified (e.g. paused) between scheduler wakeups are too
+        processed = job.id in self._due_job_ids
+        # Only updates of jobs known to exist are deferred, the others
+        # are written right away to report missing ones
+        if self._batching and processed:
+            pending = self._pending_updates.get(job.id)
+            if pending and not fields:
+                fields = pending[1]
+            self._pending_updates[job.id] = (next_run_time, fields)
+        else:
+            try:
+                res = (self.jobs_t
+                       .update(next_run_time=next_run_time, **fields)
+                       .where(self.jobs_t.id == job.id)
+                       .execute())
+            except Exception:
+                # Definition wasn't written, write it with the next update
+                self._definitions.pop(job.id, None)
+                raise
+            if res == 0:
+                self._definitions.pop(job.id, None)
+                raise JobLookupError(job.id)
+            if fields or not processed:
+                self._notify(job.id)
+        if self._index is not None:
+            self._index.add(job, next_run_time)
 
     def remove_job(self, job_id):
+        self._pending_updates.pop(job_id, None)
+        self._due_job_ids.discard(job_id)
+        self._definitions.pop(job_id, None)
         res = (self.jobs_t
                .delete()
                .where(self.jobs_t.id == job_id)
                .execute())
         if res == 0:
             raise JobLookupError(job_id)
+        if self._index is not None:
+            self._index.remove(job_id)
+        self._notify(job_id)
 
     def remove_all_jobs(self):
+        self._batching = False
+        self._pending_updates = {}
+        self._definitions.clear()
         self.jobs_t.delete().execute()
+        if self._index is not None:
+            self._index.clear()
+        self._notify(None)
+
+    def invalidate_job(self, job_id):
+        """Marks job changed by another node, job_id None marks all jobs."""
+        if self._index is not None:
+            with self._stale_lock:
+                self._stale_job_ids.add(job_id)
 
     def shutdown(self):
+        self._flush_updates()
         if not self.jobs_t._meta.database.is_closed():
             self.jobs_t._meta.database.close()
 
-    def _reconstitute_job(self, job_state):
-        job_state = pickle.loads(job_state)
+    def _notify(self, job_id):
+        if not self.notify_channel:
+            return
+        payload = json.dumps({"node_id": self.node_id, "job_id": job_id})
+        try:
+            self.jobs_t._meta.database.execute_sql(
+                "SELECT pg_notify(%s, %s)", (self.notify_channel, payload))
+        except Exception:
+            self._logger.exception("Unable to notify about job %s", job_id)
+
+    def _refresh_stale_jobs(self):
+        with self._stale_lock:
+            if not self._stale_job_ids:
+                return
+            job_ids, self._stale_job_ids = self._stale_job_ids, set()
+        if None in job_ids:
+            self._index.clear()
+            self._definitions.clear()
+            rows = self.jobs_t.select()
+        else:
+            for job_id in job_ids:
+                self._index.remove(job_id)
+                self._definitions.pop(job_id, None)
+            rows = self.jobs_t.select().where(self.jobs_t.id.in_(job_ids))
+        for row in list(rows):
+            try:
+                job = self._reconstitute_job(row)
+            except BaseException:
+                self._logger.exception("Unable to restore job '%s'", row.id)
+                continue
+            self._index.add(job, row.next_run_time)
+
+    def _claim_due_jobs(self, timestamp):
+        """Leases due jobs not leased to other nodes and returns them.
+
+        Jobs still leased to this node are claimed again, the scheduler
+        doesn't run more instances than their max_instances allows.
+        """
+        database = self.jobs_t._meta.database
+        with database.atomic():
+            self._release_finished_jobs()
+            rows = list(self.jobs_t
+                        .select()
+                        .where(self.jobs_t.next_run_time <= timestamp,
+                               self.jobs_t.lease_expires_at.is_null() |
+                               (self.jobs_t.lease_expires_at <= timestamp) |
+                               (self.jobs_t.lease_owner == self.node_id))
+                        .order_by(self.jobs_t.next_run_time)
+                        .limit(self.claim_limit)
+                        .for_update("FOR UPDATE SKIP LOCKED"))
+            if rows:
+                (self.jobs_t
+                    .update(lease_owner=self.node_id,
+                            lease_expires_at=timestamp + self.lease_seconds)
+                    .where(self.jobs_t.id.in_([row.id for row in rows]))
+                    .execute())
+        return self._restore_jobs(rows)
+
+    def _job_finished(self, event):
+        if event.jobstore != self._alias:
+            return
+        with self._finished_lock:
+            self._finished_job_ids.add(event.job_id)
+
+    def _release_finished_jobs(self):
+        """Releases finished jobs, their next run can be claimed by any node.
+        """
+        with self._finished_lock:
+            job_ids, self._finished_job_ids = self._finished_job_ids, set()
+        if job_ids:
+            (self.jobs_t
+                .update(lease_owner=None, lease_expires_at=None)
+                .where(self.jobs_t.id.in_(job_ids),
+                       self.jobs_t.lease_owner == self.node_id)
+                .execute())
+
+    def _serialize_job(self, state):
+        columns = encode_job_state(state) if self.compact_state else None
+        if columns is None:
+            columns = dict.fromkeys(COMPACT_COLUMNS)
+            columns["job_state"] = pickle.dumps(state, self.pickle_protocol)
+        else:
+            columns["job_state"] = None
+        columns.update(self._summarize_job(state))
+        return columns
+
+    def _summarize_job(self, state):
+        # APScron jobs are added with [job_module, job_id, user_id] args,
+        # job_module being "jobs.<available job name>"
+        args = state["args"]
+        summary = {"name": state["name"],
+                   "module": args[0].split(".")[-1] if args else None,
+                   "user_id": args[-1] if len(args) > 2 else None,
+                   "timezone": trigger_zone(state["trigger"])}
+        if is_json_safe(state["kwargs"]):
+            summary["kwargs"] = state["kwargs"]
+        return summary
+
+    def _fill_summaries(self):
+        """Fills job summary of rows stored before it was introduced."""
+        rows = (self.jobs_t
+                .select()
+                .where(self.jobs_t.name.is_null() |
+                       self.jobs_t.timezone.is_null()))
+        for row in list(rows):
+            try:
+                job = self._reconstitute_job(row)
+            except BaseException:
+                # Broken jobs are removed once all jobs are loaded
+                continue
+            (self.jobs_t
+                .update(**self._summarize_job(job.__getstate__()))
+                .where(self.jobs_t.id == row.id)
+                .execute())
+
+    def _remember_definition(self, job_id, state):
+        """Remembers static job definition, returns True if it changed."""
+        definition = dict(state)
+        definition.pop("next_run_time", None)
+        changed = self._definitions.get(job_id) != definition
+        self._definitions[job_id] = definition
+        return changed
+
+    def _reconstitute_job(self, row):
+        if row.job_state is not None:
+            job_state = pickle.loads(row.job_state)
+        else:
+            job_state = decode_job_state(row)
+        # Next run time column is the only one updated on every run
+        job_state["next_run_time"] = restore_next_run_time(
+            job_state["trigger"], row.next_run_time)
+        self._remember_definition(row.id, job_state)
         job_state['jobstore'] = self
         job = Job.__new__(Job)
         job.__setstate__(job_state)
@@ -109,18 +410,73 @@ class PeeweeJobStore(BaseJobStore):
         job._jobstore_alias = self._alias
         return job
 
+    def _flush_updates(self):
+        self._batching = False
+        if not self._pending_updates:
+            return
+        updates = self._pending_updates
+        self._pending_updates = {}
+        rows = [(job_id, next_run_time)
+                for job_id, (next_run_time, fields) in updates.items()
+                if not fields]
+        updated_job_ids = set()
+        try:
+            with self.jobs_t._meta.database.atomic():
+                for i in range(0, len(rows), self.batch_size):
+                    values = ValuesList(
+                        rows[i:i + self.batch_size],
+                        columns=("id", "next_run_time"),
+                        alias="batch")
+                    cursor = (self.jobs_t
+                              .update(next_run_time=values.c.next_run_time)
+                              .from_(values)
+                              .where(self.jobs_t.id == values.c.id)
+                              .returning(self.jobs_t.id)
+                              .tuples()
+                              .execute())
+                    updated_job_ids.update(job_id for job_id, in cursor)
+                # Jobs with a changed definition are rare, update one by one
+                for job_id, (next_run_time, fields) in updates.items():
+                    if fields and (self.jobs_t
+                                   .update(next_run_time=next_run_time,
+                                           **fields)
+                                   .where(self.jobs_t.id == job_id)
+                                   .execute()):
+                        updated_job_ids.add(job_id)
+        except Exception:
+            self._logger.exception(
+                "Unable to write %s job updates -- retrying later",
+                len(updates))
+            # Keep failed updates unless the job was updated again since
+            for job_id, update in updates.items():
+                self._pending_updates.setdefault(job_id, update)
+            return
+        # Jobs removed by other nodes after they were read, too late
+        # to raise JobLookupError to the scheduler
+        for job_id in updates.keys() - updated_job_ids:
+            self._logger.warning(
+                "Unable to update job '%s' -- it was removed", job_id)
+            self._definitions.pop(job_id, None)
+            if self._index is not None:
+                self._index.remove(job_id)
+        for job_id in updated_job_ids:
+            if updates[job_id][1]:
+                self._notify(job_id)
+
     def _get_jobs(self, *conditions):
-        jobs = []
         selectable = (self.jobs_t
-                      .select(self.jobs_t.id, self.jobs_t.job_state)
+                      .select()
                       .order_by(self.jobs_t.next_run_time))
         selectable = (selectable.where(*conditions)
                       if conditions else selectable)
+        return self._restore_jobs(list(selectable))
 
+    def _restore_jobs(self, rows):
+        jobs = []
         failed_job_ids = set()
-        for row in list(selectable):
+        for row in rows:
             try:
-                jobs.append(self._reconstitute_job(row.job_state))
+                jobs.append(self._reconstitute_job(row))
             except BaseException:
                 self._logger.exception(
                     "Unable to restore job '%s' -- removing it", row.id)
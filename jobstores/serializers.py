@@ -0,0 +1,144 @@
+"""
+Compact job serialization used by PeeweeJobStore.
+
+Instead of pickling the whole Job state, the static job definition is
+split into JSON columns: textual func reference, trigger encoded by its
+constructor parameters, args, kwargs and the remaining job options.
+Next run time lives in its own column only. Jobs which can't be encoded
+(custom triggers, values JSON can't represent) are pickled as before.
+"""
+import json
+
+from apscheduler.util import (astimezone, datetime_to_utc_timestamp,
+                              utc_timestamp_to_datetime)
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.cron import CronTrigger
+
+
+JOB_OPTIONS = ("version", "executor", "name", "misfire_grace_time",
+               "coalesce", "max_instances")
+
+
+def _zone(tz):
+    zone = getattr(tz, "zone", None)
+    if not zone:
+        raise ValueError("Timezone %r can't be encoded" % tz)
+    return zone
+
+
+def _encode_date(value):
+    return datetime_to_utc_timestamp(value) if value else None
+
+
+def _decode_date(value, timezone):
+    if value is None:
+        return None
+    return utc_timestamp_to_datetime(value).astimezone(timezone)
+
+
+def encode_trigger(trigger):
+    """Encodes built-in trigger as JSON serializable dict.
+
+    Raises ValueError for triggers which can't be encoded.
+    """
+    if isinstance(trigger, CronTrigger):
+        return {"type": "cron",
+                "fields": {f.name: str(f) for f in trigger.fields
+                           if not f.is_default},
+                "timezone": _zone(trigger.timezone),
+                "start_date": _encode_date(trigger.start_date),
+                "end_date": _encode_date(trigger.end_date),
+                "jitter": trigger.jitter}
+    elif isinstance(trigger, IntervalTrigger):
+        return {"type": "interval",
+                "seconds": trigger.interval.total_seconds(),
+                "timezone": _zone(trigger.timezone),
+                "start_date": _encode_date(trigger.start_date),
+                "end_date": _encode_date(trigger.end_date),
+                "jitter": trigger.jitter}
+    elif isinstance(trigger, DateTrigger):
+        return {"type": "date",
+                "run_date": _encode_date(trigger.run_date),
+                "timezone": _zone(trigger.run_date.tzinfo)}
+    raise ValueError("Trigger %r can't be encoded" % trigger)
+
+
+def decode_trigger(data):
+    timezone = astimezone(data["timezone"])
+    if data["type"] == "cron":
+        return CronTrigger(
+            timezone=timezone,
+            start_date=_decode_date(data["start_date"], timezone),
+            end_date=_decode_date(data["end_date"], timezone),
+            jitter=data["jitter"], **data["fields"])
+    elif data["type"] == "interval":
+        return IntervalTrigger(
+            seconds=data["seconds"], timezone=timezone,
+            start_date=_decode_date(data["start_date"], timezone),
+            end_date=_decode_date(data["end_date"], timezone),
+            jitter=data["jitter"])
+    elif data["type"] == "date":
+        return DateTrigger(
+            run_date=_decode_date(data["run_date"], timezone),
+            timezone=timezone)
+    raise ValueError("Unknown trigger type %s" % data["type"])
+
+
+def is_json_safe(value):
+    """Checks that value survives JSON round trip unchanged."""
+    try:
+        return json.loads(json.dumps(value)) == value
+    except (TypeError, ValueError):
+        return False
+
+
+def encode_job_state(state):
+    """Splits Job state into compact column values.
+
+    Returns None when job can't be represented in compact form.
+    """
+    try:
+        columns = {"func": state["func"],
+                   "trigger": encode_trigger(state["trigger"]),
+                   "args": list(state["args"]),
+                   "kwargs": state["kwargs"],
+                   "job_options": {k: state[k] for k in JOB_OPTIONS}}
+    except ValueError:
+        return None
+    for key in ("args", "kwargs", "job_options"):
+        if not is_json_safe(columns[key]):
+            return None
+    return columns
+
+
+def decode_job_state(row):
+    """Restores Job state from compact columns, except next run time."""
+    state = dict(row.job_options)
+    state.update(id=row.id,
+                 func=row.func,
+                 trigger=decode_trigger(row.trigger),
+                 args=row.args,
+                 kwargs=row.kwargs)
+    return state
+
+
+def _trigger_timezone(trigger):
+    timezone = getattr(trigger, "timezone", None)
+    if timezone is None and isinstance(trigger, DateTrigger):
+        timezone = trigger.run_date.tzinfo
+    return timezone
+
+
+def trigger_zone(trigger):
+    """Gets name of trigger timezone, None if it has no name."""
+    return getattr(_trigger_timezone(trigger), "zone", None)
+
+
+def restore_next_run_time(trigger, timestamp):
+    """Converts next run timestamp into a datetime in trigger timezone."""
+    next_run_time = utc_timestamp_to_datetime(timestamp)
+    timezone = _trigger_timezone(trigger)
+    if next_run_time and timezone:
+        return next_run_time.astimezone(timezone)
+    return next_run_time
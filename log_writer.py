@@ -0,0 +1,123 @@
+import time
+import asyncio
+import logging
+
+
+class BufferedLogWriter(object):
+    """
+    Buffers log rows of a model and inserts them with multi-row INSERTs.
+
+    Rows are flushed once max_batch rows are buffered or flush_interval
+    seconds passed, whichever comes first. Writers wait for a flush when
+    max_pending rows are already waiting to be written. Rows of a failed
+    flush are kept and written with the next one. Metrics are logged
+    every metrics_interval seconds, None disables it.
+    """
+
+    def __init__(self, db, model, max_batch=500, flush_interval=1.0,
+                 max_pending=10000, metrics_interval=None):
+        self.db = db
+        self.model = model
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.metrics_interval = metrics_interval
+        self.log = logging.getLogger("apscron")
+        self.metrics = {"written": 0,
+                        "failed_flushes": 0,
+                        "pending": 0,
+                        "last_flush_at": None,
+                        "last_flush_lag": 0,
+                        "max_flush_lag": 0}
+        # Primary keys and sequence columns are filled by the database
+        self._fields = [f for f in model._meta.sorted_fields
+                        if f is not model._meta.primary_key
+                        and not f.sequence]
+        self._rows = []
+        self._oldest_at = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._timer_task = None
+
+    async def start(self):
+        self._timer_task = asyncio.ensure_future(self._flush_periodically())
+
+    async def close(self):
+        """Stops periodic flushes and writes all buffered rows."""
+        if self._timer_task:
+            self._timer_task.cancel()
+            self._timer_task = None
+        await self.flush()
+        if self._rows:
+            self.log.error("%s %s rows were not written",
+                           len(self._rows), self.model.__name__)
+
+    async def write(self, **data):
+        """Buffers log row, data keys missing from the model are ignored."""
+        if len(self._rows) >= self.max_pending:
+            await self.flush()
+            # Rows of a failed flush are kept, drop the oldest over the limit
+            del self._rows[:max(0, len(self._rows) - self.max_pending + 1)]
+        if not self._rows:
+            self._oldest_at = time.monotonic()
+        self._rows.append(self._to_row(data))
+        self.metrics["pending"] = len(self._rows)
+        if len(self._rows) >= self.max_batch and (
+                self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._rows:
+                return
+            rows, self._rows = self._rows, []
+            oldest_at, self._oldest_at = self._oldest_at, None
+            try:
+                for i in range(0, len(rows), self.max_batch):
+                    await self.db.execute(self.model.insert_many(
+                        rows[i:i + self.max_batch]))
+            except Exception:
+                self.log.exception("Unable to write %s %s rows",
+                                   len(rows), self.model.__name__)
+                self.metrics["failed_flushes"] += 1
+                # Keep rows for the next flush, dropping the oldest ones
+                # over the limit
+                self._rows = (rows + self._rows)[-self.max_pending:]
+                self._oldest_at = oldest_at
+            else:
+                lag = time.monotonic() - oldest_at
+                self.metrics["written"] += len(rows)
+                self.metrics["last_flush_at"] = time.time()
+                self.metrics["last_flush_lag"] = lag
+                self.metrics["max_flush_lag"] = max(
+                    lag, self.metrics["max_flush_lag"])
+            self.metrics["pending"] = len(self._rows)
+
+    def log_metrics(self):
+        self.log.info("%s writer metrics: %s",
+                      self.model.__name__, self.metrics)
+
+    async def _flush_periodically(self):
+        metrics_logged_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                self.log.exception("%s flush failed", self.model.__name__)
+            if (self.metrics_interval and time.monotonic() -
+                    metrics_logged_at >= self.metrics_interval):
+                metrics_logged_at = time.monotonic()
+                self.log_metrics()
+
+    def _to_row(self, data):
+        # insert_many requires the same columns in every row
+        row = {}
+        for field in self._fields:
+            if field.name in data:
+                row[field.name] = data[field.name]
+            elif callable(field.default):
+                row[field.name] = field.default()
+            else:
+                row[field.name] = field.default
+        return row
@@ -1,11 +1,7 @@
 import os
 import base64
 
-import jinja2
-import aiohttp_jinja2
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.executors.asyncio import AsyncIOExecutor
-# from apscheduler.executors.pool import ThreadPoolExecutor, ProcessPoolExecutor
 from cryptography import fernet
 from aiohttp import web
 from aiohttp_session import setup
@@ -15,10 +11,15 @@ from pytz import utc
 import config
 from views import routes
 from utils import (setup_routes, setup_middlewares, get_log, init_app,
-                   close_app, setup_template_functions)
+                   close_app, create_template_env)
 from middlewares import middlewares
 from jobstores.peewee_jobstore import PeeweeJobStore
-from models import async_db_manager
+from jobstores.listener import JobChangesListener
+from schedulers.asyncio_scheduler import NonBlockingAsyncIOScheduler
+from schedulers.executors import create_executors
+from models import async_db_manager, apscron_db
+from clients import SMTPMailer
+from jobs import setup_jobs
 
 
 # Create logs folder
@@ -44,33 +45,35 @@ setup(app, EncryptedCookieStorage(
     secret_key, cookie_name=config.COOKIE_NAME, max_age=config.MAX_AGE))
 
 # Setup template environment and functions
-jinja_env = aiohttp_jinja2.setup(
-    app,
-    loader=jinja2.FileSystemLoader(config.DIRS["TEMPLATE_DIR"]),
-    context_processors=[aiohttp_jinja2.request_processor])
-
-setup_template_functions(jinja_env)
+create_template_env(app)
 
 jobstores = {
-    "default": PeeweeJobStore()
-}
-executors = {
-    "default": AsyncIOExecutor()
+    "default": PeeweeJobStore(**config.JOBSTORE_CONFIG)
 }
-# executors = {
-#     "default": ThreadPoolExecutor(20),
-#     "processpool": ProcessPoolExecutor(5)
-# }
+if config.SCHEDULER_CONFIG["non_blocking"]:
+    scheduler_class = NonBlockingAsyncIOScheduler
+else:
+    scheduler_class = AsyncIOScheduler
+executors = create_executors(
+    config.EXECUTORS, config.SCHEDULER_CONFIG["non_blocking"])
 job_defaults = {
     "coalesce": True,
 }
-scheduler = AsyncIOScheduler(jobstores=jobstores, executors=executors,
-                             job_defaults=job_defaults, timezone=utc)
+scheduler = scheduler_class(jobstores=jobstores, executors=executors,
+                            job_defaults=job_defaults, timezone=utc)
 
 # Set extra objects to manage on application start/shutdown
 app["app_log"] = app_log
 app["apscron_db"] = async_db_manager
 app["apscheduler"] = scheduler
+if config.JOBSTORE_CONFIG.get("notify_channel"):
+    app["jobstore_listener"] = JobChangesListener(
+        scheduler, jobstores["default"], apscron_db)
+app["mailer"] = SMTPMailer(
+    config.SMTP_HOST, config.SMTP_PORT, user=config.SMTP_USER,
+    password=config.SMTP_PASSWORD, use_tls=config.SMTP_USE_TLS,
+    connections=config.SMTP_CONNECTIONS)
+setup_jobs(app)
 
 # Initialize database connection on application startup
 app.on_startup.append(init_app)
@@ -5,7 +5,7 @@ from aiohttp.web_response import StreamResponse
 from aiohttp.web_exceptions import HTTPException, HTTPRedirection
 
 from controllers import ControllerResponse
-from utils import get_error_response
+from utils import get_error_response, json_response
 
 
 @web.middleware
@@ -40,7 +40,7 @@ async def request_middleware(request, handler):
             messages = request.pop("messages", None)
             if messages:
                 response["messages"] = messages
-            return web.json_response(response, **response.overrides)
+            return json_response(response, **response.overrides)
         else:
             return await get_error_response(
                 "Failed to process request", HTTPStatus.INTERNAL_SERVER_ERROR)
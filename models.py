@@ -1,17 +1,18 @@
-import base64
-import hashlib
-import os
 from datetime import datetime
 
 from peewee import (Model, CharField, DateTimeField, ForeignKeyField,
                     TextField, IntegerField, BooleanField, DoubleField,
-                    BlobField)
+                    BlobField, CompositeKey)
 import peewee_async
 import peewee_asyncext
-from playhouse.postgres_ext import JSONField
+from playhouse.postgres_ext import JSONField, BinaryJSONField
 from playhouse.pool import PooledPostgresqlExtDatabase
+from playhouse.migrate import PostgresqlMigrator, migrate
 
-from config import DB_CONFIG
+from config import (DB_CONFIG, PASSWORD_HASHER_CONFIG, LOG_SEARCH_CONFIG,
+                    LOG_PARTITION_CONFIG)
+from passwords import PasswordHasher
+from partitions import LogPartitioner
 from constants import Permission
 
 apscron_db = PooledPostgresqlExtDatabase(**DB_CONFIG)
@@ -74,15 +75,54 @@ class APSchedulerJob(_Model):
 
     id = CharField(primary_key=True)
     next_run_time = DoubleField(index=True, null=True)
-    job_state = BlobField()
+    # Pickled job state, empty for jobs stored in compact format
+    job_state = BlobField(null=True)
+    # Compact format, static job definition
+    func = CharField(null=True)
+    trigger = BinaryJSONField(null=True)
+    args = BinaryJSONField(null=True)
+    kwargs = BinaryJSONField(null=True)
+    job_options = BinaryJSONField(null=True)
+    # Job summary, readable without restoring the job.
+    # Kwargs above are filled for pickled jobs too whenever possible
+    name = CharField(null=True)
+    module = CharField(null=True)
+    user_id = IntegerField(null=True, index=True)
+    # Trigger timezone name, next run time is shown in it
+    timezone = CharField(null=True)
+    # Node which claimed the due job and when its claim expires,
+    # used when several apscron nodes share the table
+    lease_owner = CharField(null=True)
+    lease_expires_at = DoubleField(null=True)
+
+
+def partitioned_by(column_name):
+    """Table settings of log tables, partitioned by range of the column.
+
+    Primary keys of partitioned tables have to include the column, so log
+    models use (id, column) composite keys with id taken from a sequence.
+    """
+    if LOG_PARTITION_CONFIG["enabled"]:
+        return ["PARTITION BY RANGE (%s)" % column_name]
+    return []
 
 
 class UserLog(_Model):
 
     class Meta:
         table_name = "user_logs"
-
-    user = ForeignKeyField(User, null=True, on_delete="CASCADE")
+        primary_key = CompositeKey("id", "created_at")
+        # Time column of partitions and retention
+        partition_column = "created_at"
+        table_settings = partitioned_by(partition_column)
+        # Log list filters, each followed by the list order
+        indexes = ((("created_at", "id"), False),
+                   (("user", "created_at", "id"), False),
+                   (("log_type", "created_at", "id"), False))
+        dropped_indexes = ("userlog_created_at", "userlog_user_id")
+
+    id = IntegerField(sequence="user_logs_id_seq")
+    user = ForeignKeyField(User, null=True, on_delete="CASCADE", index=False)
     log_type = IntegerField()
     request_data = TextField()
     request_ip = CharField(null=True)
@@ -90,7 +130,7 @@ class UserLog(_Model):
     request_method = CharField()
     response_data = TextField()
     error = TextField(null=True)
-    created_at = DateTimeField(default=datetime.now, index=True)
+    created_at = DateTimeField(default=datetime.now)
     finished_at = DateTimeField(null=True)
 
 
@@ -98,13 +138,23 @@ class JobLog(_Model):
 
     class Meta:
         table_name = "job_logs"
-
-    user = ForeignKeyField(User, null=True, on_delete="CASCADE")
+        primary_key = CompositeKey("id", "started_at")
+        # Time column of partitions and retention
+        partition_column = "started_at"
+        table_settings = partitioned_by(partition_column)
+        # Log list filters, each followed by the list order
+        indexes = ((("started_at", "id"), False),
+                   (("user", "started_at", "id"), False),
+                   (("finished_at",), False))
+        dropped_indexes = ("joblog_user_id",)
+
+    id = IntegerField(sequence="job_logs_id_seq")
+    user = ForeignKeyField(User, null=True, on_delete="CASCADE", index=False)
     job_id = CharField()
     job_data = JSONField(default={})
     job_result = JSONField(default={})
     error = TextField(null=True)
-    started_at = DateTimeField(null=True)
+    started_at = DateTimeField(default=datetime.now)
     finished_at = DateTimeField(null=True)
 
 
@@ -112,7 +162,14 @@ class ErrorLog(_Model):
 
     class Meta:
         table_name = "error_logs"
-
+        primary_key = CompositeKey("id", "created_at")
+        # Time column of partitions and retention
+        partition_column = "created_at"
+        table_settings = partitioned_by(partition_column)
+        # Log list order and created_at filter
+        indexes = ((("created_at", "id"), False),)
+
+    id = IntegerField(sequence="error_logs_id_seq")
     request_data = TextField()
     request_ip = CharField()
     request_url = CharField()
@@ -122,26 +179,156 @@ class ErrorLog(_Model):
     created_at = DateTimeField(default=datetime.now)
 
 
+class RevokedToken(_Model):
+
+    class Meta:
+        table_name = "revoked_tokens"
+
+    # Token jti claim, or SHA-256 of tokens without it
+    key = CharField(primary_key=True)
+    expires_at = DateTimeField(index=True)
+    revoked_at = DateTimeField(default=datetime.utcnow, index=True)
+
+
+# Trigram indexes of models, {model: [(index name, column name)]}
+trigram_indexes = {}
+
+
+def add_trigram_indexes(model, *field_names):
+    """Adds GIN trigram indexes, used by ILIKE searches of the fields.
+    They are created by create_indexes.
+    """
+    for name in field_names:
+        column_name = model._meta.fields[name].column_name
+        trigram_indexes.setdefault(model, []).append(
+            ("%s_%s_trgm" % (model._meta.table_name, column_name),
+             column_name))
+
+
+if LOG_SEARCH_CONFIG["trigram_indexes"]:
+    add_trigram_indexes(UserLog, "request_data", "response_data", "error",
+                        "request_ip", "request_url")
+    add_trigram_indexes(JobLog, "error", "job_id")
+    add_trigram_indexes(ErrorLog, "request_data", "request_ip",
+                        "request_url", "error", "traceback")
+
+
+def get_index_statements(model):
+    """Gets (index name, CREATE INDEX statement) of model indexes,
+    trigram indexes included.
+    """
+    statements = []
+    for index in model._meta.fields_to_index():
+        sql, params = model._schema._create_index(index, safe=False).query()
+        statements.append((index._name, sql, params))
+    for index_name, column_name in trigram_indexes.get(model, ()):
+        statements.append((
+            index_name,
+            'CREATE INDEX "%s" ON "%s" USING gin ("%s" gin_trgm_ops)' % (
+                index_name, model._meta.table_name, column_name), []))
+    return statements
+
+
+def create_indexes(model):
+    """Creates missing indexes of the model table and drops indexes named
+    in Meta.dropped_indexes.
+
+    Indexes are built and dropped CONCURRENTLY, so writes to the table go
+    on meanwhile. It can't run in a transaction, the connection is switched
+    to autocommit meanwhile. Invalid indexes left by interrupted builds are
+    rebuilt. Partitioned tables don't support it, their indexes are created
+    with CREATE INDEX, which locks writes to all partitions until it's done.
+    """
+    database = model._meta.database
+    table_name = model._meta.table_name
+    partitioned = database.execute_sql(
+        "SELECT 1 FROM pg_partitioned_table "
+        "WHERE partrelid = to_regclass(%s)", (table_name,)).fetchone()
+    concurrently = "" if partitioned else " CONCURRENTLY"
+    connection = database.connection()
+    connection.autocommit = True
+    try:
+        cursor = connection.cursor()
+        for index_name, sql, params in get_index_statements(model):
+            cursor.execute(
+                "SELECT indisvalid FROM pg_index "
+                "WHERE indexrelid = to_regclass(%s)", (index_name,))
+            row = cursor.fetchone()
+            if row and row[0]:
+                continue
+            if row:
+                cursor.execute('DROP INDEX%s "%s"' % (
+                    concurrently, index_name))
+            # CREATE [UNIQUE] INDEX CONCURRENTLY "name" ON ...
+            cursor.execute(
+                sql.replace("INDEX ", "INDEX%s " % concurrently, 1),
+                params or None)
+        for index_name in getattr(model._meta, "dropped_indexes", ()):
+            cursor.execute('DROP INDEX%s IF EXISTS "%s"' % (
+                concurrently, index_name))
+    finally:
+        connection.autocommit = False
+
+
+def migrate_table(model):
+    """Adds model columns and indexes missing from the existing table and
+    drops NOT NULL constraints of columns made nullable since the table was
+    created. Indexes named in Meta.dropped_indexes, replaced by indexes of
+    the model, are dropped. Indexes are built by create_indexes.
+    """
+    database = model._meta.database
+    table_name = model._meta.table_name
+    columns = {c.name: c for c in database.get_columns(table_name)}
+    migrator = PostgresqlMigrator(database)
+    operations = []
+    for field in model._meta.sorted_fields:
+        column = columns.get(field.column_name)
+        if column is None:
+            operations.append(
+                migrator.add_column(table_name, field.column_name, field))
+        elif field.null and not column.null:
+            operations.append(
+                migrator.drop_not_null(table_name, field.column_name))
+    if operations:
+        migrate(*operations)
+    create_indexes(model)
+
+
+def get_log_partitioner():
+    settings = dict(LOG_PARTITION_CONFIG)
+    settings.pop("enabled")
+    return LogPartitioner(apscron_db, [UserLog, JobLog, ErrorLog], **settings)
+
+
 def init_db():
     with async_db_manager.allow_sync():
         if apscron_db.is_closed():
             apscron_db.connect()
-        tables_list = [User, APSchedulerJob, UserLog, JobLog, ErrorLog]
+        if LOG_SEARCH_CONFIG["trigram_indexes"]:
+            apscron_db.execute_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        tables_list = [User, APSchedulerJob, UserLog, JobLog, ErrorLog,
+                       RevokedToken]
         if not any([t.table_exists() for t in tables_list]):
             apscron_db.drop_tables(tables_list, safe=True)
             print("Tables were dropped")
             apscron_db.create_tables(tables_list, safe=True)
             print("Tables were created")
-            salt = os.urandom(128)
-            password = "1"
+            password, salt = PasswordHasher(
+                **PASSWORD_HASHER_CONFIG).hash_sync("1")
             User.create(
                 username="admin",
-                password=base64.b64encode(
-                    hashlib.scrypt(password.encode("utf-8"),
-                                   salt=salt, n=1024, r=8, p=16)),
-                salt=base64.b64encode(salt),
+                password=password,
+                salt=salt,
                 permissions=[p.get("name") for p in Permission.get_dicts()],
                 is_admin=True)
+        for table in tables_list:
+            if table.table_exists():
+                migrate_table(table)
+            else:
+                table.create_table()
+                create_indexes(table)
+        if LOG_PARTITION_CONFIG["enabled"]:
+            get_log_partitioner().maintain()
         apscron_db.close()
 
 
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from datetime import datetime
+
+
+def month_start(value, months=0):
+    """Gets first day of the month, shifted by months."""
+    month = value.year * 12 + value.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def day_start(value, days=0):
+    return datetime.fromordinal(value.toordinal() + days)
+
+
+# Partition interval: function getting start of the interval shifted by
+# a number of intervals and partition name suffix format
+INTERVALS = {"month": (month_start, "%Y%m"),
+             "day": (day_start, "%Y%m%d")}
+
+
+class LogPartitioner(object):
+    """
+    Maintains range partitions of log tables partitioned by time.
+
+    Every "interval" partition is created "premake" intervals ahead, rows
+    outside of them go to the default partition. Partitions which ended
+    more than "retention" intervals before the current one started are
+    dropped, which is instant unlike deleting their rows. Tables created
+    before partitioning was enabled are not partitioned, their expired rows
+    (by Meta.partition_column of the model) are deleted instead, at most
+    delete_batch_size rows per transaction. maintain runs synchronous
+    queries, start runs it in a worker thread every maintenance_interval
+    seconds.
+    """
+
+    def __init__(self, database, models, interval="month", premake=2,
+                 retention=None, maintenance_interval=3600,
+                 delete_batch_size=10000):
+        if interval not in INTERVALS:
+            raise ValueError("Unknown partition interval %s" % interval)
+        self.database = database
+        self.models = models
+        self.interval = interval
+        self.premake = premake
+        self.retention = retention
+        self.maintenance_interval = maintenance_interval
+        self.delete_batch_size = delete_batch_size
+        self.log = logging.getLogger("apscron")
+        self._maintenance_task = None
+
+    async def start(self):
+        await self._run_maintain()
+        self._maintenance_task = asyncio.ensure_future(
+            self._maintain_periodically())
+
+    async def close(self):
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+            self._maintenance_task = None
+
+    def maintain(self, now=None):
+        now = now or datetime.now()
+        unpartitioned = []
+        with self.database.connection_context():
+            with self.database.atomic():
+                # Serializes maintenance of all apscron processes
+                self.database.execute_sql(
+                    "SELECT pg_advisory_xact_lock(hashtext(%s))",
+                    ("apscron_log_partitions",))
+                for model in self.models:
+                    table_name = model._meta.table_name
+                    if not self._is_partitioned(table_name):
+                        unpartitioned.append(model)
+                        continue
+                    self._create_partitions(table_name, now)
+                    if self.retention is not None:
+                        self._drop_partitions(table_name, now)
+            # Deleted in batches of their own transactions, outside the
+            # lock, so log writes aren't blocked for long
+            for model in unpartitioned:
+                if self.retention is None:
+                    self.log.info("Log table %s is not partitioned",
+                                  model._meta.table_name)
+                else:
+                    self._delete_expired_rows(model, now)
+
+    def _is_partitioned(self, table_name):
+        cursor = self.database.execute_sql(
+            "SELECT 1 FROM pg_partitioned_table "
+            "WHERE partrelid = to_regclass(%s)", (table_name,))
+        return cursor.fetchone() is not None
+
+    def _create_partitions(self, table_name, now):
+        interval_start, name_format = INTERVALS[self.interval]
+        self._execute_ddl(
+            'CREATE TABLE IF NOT EXISTS "%s_default" PARTITION OF "%s" '
+            'DEFAULT' % (table_name, table_name))
+        for i in range(self.premake + 1):
+            start = interval_start(now, i)
+            self._execute_ddl(
+                'CREATE TABLE IF NOT EXISTS "%s_p%s" PARTITION OF "%s" '
+                'FOR VALUES FROM (%%s) TO (%%s)' % (
+                    table_name, start.strftime(name_format), table_name),
+                (start, interval_start(now, i + 1)))
+
+    def _drop_partitions(self, table_name, now):
+        interval_start = INTERVALS[self.interval][0]
+        expired_before = interval_start(now, -self.retention)
+        cursor = self.database.execute_sql(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)", (table_name,))
+        for partition_name, in cursor.fetchall():
+            end = self._get_partition_end(table_name, partition_name)
+            if end is not None and end <= expired_before:
+                self.log.info("Dropping expired log partition %s",
+                              partition_name)
+                self._execute_ddl('DROP TABLE "%s"' % partition_name)
+
+    def _delete_expired_rows(self, model, now):
+        table_name = model._meta.table_name
+        column_name = model._meta.partition_column
+        expired_before = INTERVALS[self.interval][0](now, -self.retention)
+        deleted = 0
+        while True:
+            with self.database.atomic():
+                cursor = self.database.execute_sql(
+                    'DELETE FROM "%s" WHERE ctid IN (SELECT ctid FROM "%s" '
+                    'WHERE "%s" < %%s LIMIT %%s)' % (
+                        table_name, table_name, column_name),
+                    (expired_before, self.delete_batch_size))
+            deleted += cursor.rowcount
+            if cursor.rowcount < self.delete_batch_size:
+                break
+        self.log.info("Log table %s is not partitioned, deleted %s rows "
+                      "older than %s", table_name, deleted, expired_before)
+
+    def _get_partition_end(self, table_name, partition_name):
+        """Gets end of partition range from its name, None for others."""
+        if not partition_name.startswith(table_name + "_p"):
+            return None
+        suffix = partition_name[len(table_name) + 2:]
+        for interval_start, name_format in INTERVALS.values():
+            try:
+                start = datetime.strptime(suffix, name_format)
+            except ValueError:
+                continue
+            return interval_start(start, 1)
+        return None
+
+    def _execute_ddl(self, sql, params=None):
+        # Savepoint keeps the maintenance going when a statement fails,
+        # e.g. partition overlaps rows of the default partition
+        try:
+            with self.database.atomic():
+                self.database.execute_sql(sql, params)
+        except Exception:
+            self.log.exception("Log partition maintenance failed: %s", sql)
+
+    async def _run_maintain(self):
+        try:
+            await asyncio.get_event_loop().run_in_executor(
+                None, self.maintain)
+        except Exception:
+            self.log.exception("Unable to maintain log partitions")
+
+    async def _maintain_periodically(self):
+        while True:
+            await asyncio.sleep(self.maintenance_interval)
+            await self._run_maintain()
@@ -0,0 +1,81 @@
+import os
+import hmac
+import base64
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Cost parameters of hashes stored before they were encoded with the hash
+LEGACY_PARAMETERS = (1024, 8, 16)
+
+
+class PasswordHasher(object):
+    """
+    Hashes and verifies passwords with scrypt off the event loop.
+
+    scrypt runs in a dedicated thread pool of max_workers threads and at
+    most max_concurrency hashes are queued or running at once, further
+    callers wait. Hashes are stored as "scrypt$n$r$p$<base64 hash>", so
+    cost parameters can be changed without breaking existing passwords.
+    Bare base64 hashes are verified with LEGACY_PARAMETERS.
+    """
+
+    def __init__(self, n=1024, r=8, p=16, salt_size=128, max_workers=4,
+                 max_concurrency=16):
+        self.parameters = (n, r, p)
+        self.salt_size = salt_size
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency
+        self._executor = None
+        self._semaphore = None
+
+    async def start(self):
+        self._executor = ThreadPoolExecutor(
+            self.max_workers, thread_name_prefix="apscron_passwords")
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+
+    async def hash(self, password):
+        """Returns encoded password hash and base64 encoded salt."""
+        return await self._run(self.hash_sync, password)
+
+    async def verify(self, password, encoded, salt):
+        return await self._run(self.verify_sync, password, encoded, salt)
+
+    def hash_sync(self, password):
+        salt = os.urandom(self.salt_size)
+        password_hash = self._scrypt(password, salt, self.parameters)
+        encoded = "scrypt$%s$%s$%s$%s" % (
+            *self.parameters, base64.b64encode(password_hash).decode("utf-8"))
+        return encoded, base64.b64encode(salt).decode("utf-8")
+
+    def verify_sync(self, password, encoded, salt):
+        parameters, password_hash = self._decode(encoded)
+        return hmac.compare_digest(
+            password_hash,
+            self._scrypt(password, base64.b64decode(salt), parameters))
+
+    def needs_rehash(self, encoded):
+        """Checks if hash was made with other than current parameters."""
+        return self._decode(encoded)[0] != self.parameters
+
+    async def _run(self, func, *args):
+        async with self._semaphore:
+            return await asyncio.get_event_loop().run_in_executor(
+                self._executor, func, *args)
+
+    def _decode(self, encoded):
+        if not encoded.startswith("scrypt$"):
+            return LEGACY_PARAMETERS, base64.b64decode(encoded)
+        _, n, r, p, password_hash = encoded.split("$")
+        return (int(n), int(r), int(p)), base64.b64decode(password_hash)
+
+    def _scrypt(self, password, salt, parameters):
+        n, r, p = parameters
+        return hashlib.scrypt(str(password).encode("utf-8"),
+                              salt=salt, n=n, r=r, p=p)
@@ -0,0 +1,104 @@
+import time
+import heapq
+import asyncio
+import calendar
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+
+def get_token_key(token, token_data):
+    """Gets key a token is revoked by, its jti claim or SHA-256 hash."""
+    jti = token_data.get("jti")
+    if jti:
+        return str(jti)
+    if isinstance(token, str):
+        token = token.encode("utf-8")
+    return hashlib.sha256(token).hexdigest()
+
+
+class RevocationStore(object):
+    """
+    Revoked tokens keyed by get_token_key, checked in O(1).
+
+    Every revoked token is kept until it expires, expired tokens are
+    evicted using a heap ordered by expiration time. When model is set,
+    revocations are also stored in the database, loaded on start and
+    synced every sync_interval seconds, so they survive restarts and
+    are shared by all apscron processes.
+    """
+
+    def __init__(self, db=None, model=None, sync_interval=10):
+        self.db = db
+        self.model = model
+        self.sync_interval = sync_interval
+        self.log = logging.getLogger("apscron")
+        self._revoked = {}
+        self._expiry = []
+        self._synced_at = None
+        self._sync_task = None
+
+    def __len__(self):
+        self._evict_expired()
+        return len(self._revoked)
+
+    def is_revoked(self, key):
+        self._evict_expired()
+        return key in self._revoked
+
+    async def revoke(self, key, expires_at):
+        """Revokes token until expires_at, UTC timestamp."""
+        self._add(key, expires_at)
+        if self.model is not None:
+            await self.db.execute(
+                self.model
+                .insert(key=key,
+                        expires_at=datetime.utcfromtimestamp(expires_at))
+                .on_conflict_ignore())
+
+    async def start(self):
+        if self.model is None:
+            return
+        await self.sync()
+        self._sync_task = asyncio.ensure_future(self._sync_periodically())
+
+    async def close(self):
+        if self._sync_task:
+            self._sync_task.cancel()
+            self._sync_task = None
+
+    async def sync(self):
+        """Loads tokens revoked by other processes, deletes expired ones."""
+        now = datetime.utcnow()
+        query = self.model.select().where(self.model.expires_at > now)
+        if self._synced_at:
+            # Overlap covers clock differences between processes
+            query = query.where(
+                self.model.revoked_at >= self._synced_at - timedelta(
+                    seconds=self.sync_interval))
+        for row in await self.db.execute(query):
+            self._add(row.key,
+                      calendar.timegm(row.expires_at.utctimetuple()))
+        await self.db.execute(
+            self.model.delete().where(self.model.expires_at <= now))
+        self._synced_at = now
+
+    async def _sync_periodically(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception:
+                self.log.exception("Unable to sync revoked tokens")
+
+    def _add(self, key, expires_at):
+        if key in self._revoked or expires_at <= time.time():
+            return
+        self._revoked[key] = expires_at
+        heapq.heappush(self._expiry, (expires_at, key))
+
+    def _evict_expired(self):
+        now = time.time()
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry)
+            self._revoked.pop(key, None)
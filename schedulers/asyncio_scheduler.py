@@ -0,0 +1,83 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from apscheduler.schedulers.base import STATE_STOPPED
+from apscheduler.schedulers.asyncio import AsyncIOScheduler, run_in_event_loop
+from apscheduler.executors.asyncio import AsyncIOExecutor
+
+
+class ThreadSafeAsyncIOExecutor(AsyncIOExecutor):
+    """
+    AsyncIOExecutor which accepts jobs submitted from any thread.
+
+    Submitted jobs are handed over to the event loop with
+    call_soon_threadsafe, which is required once due jobs are processed
+    outside of the event loop by NonBlockingAsyncIOScheduler.
+    """
+
+    def _do_submit_job(self, job, run_times):
+        self._eventloop.call_soon_threadsafe(
+            super(ThreadSafeAsyncIOExecutor, self)._do_submit_job,
+            job, run_times)
+
+
+class NonBlockingAsyncIOScheduler(AsyncIOScheduler):
+    """
+    AsyncIOScheduler which processes due jobs in a dedicated worker thread.
+
+    Job store queries issued on every wakeup (get_due_jobs, update_job,
+    get_next_run_time) run outside of the event loop, so scheduler ticks
+    never stall request handling. Jobs are still run by the configured
+    executors, use ThreadSafeAsyncIOExecutor instead of AsyncIOExecutor.
+
+    Scheduler methods called from request handlers (add_job, get_job,
+    pause_job, ...) query job stores too and wait for the job stores lock
+    held while due jobs are processed, await them with run_in_db_executor.
+    """
+
+    _db_executor = None
+    _processing = None
+    _wakeup_pending = False
+
+    def start(self, paused=False):
+        self._db_executor = ThreadPoolExecutor(
+            1, thread_name_prefix="apscron_jobstore")
+        super(NonBlockingAsyncIOScheduler, self).start(paused)
+
+    def shutdown(self, wait=True):
+        super(NonBlockingAsyncIOScheduler, self).shutdown(wait)
+        self._eventloop.call_soon_threadsafe(
+            self._db_executor.shutdown, False)
+
+    def run_in_db_executor(self, func, *args, **kwargs):
+        """Runs func in the job store worker thread, returns a future."""
+        return asyncio.get_event_loop().run_in_executor(
+            self._db_executor, functools.partial(func, *args, **kwargs))
+
+    @run_in_event_loop
+    def wakeup(self):
+        self._stop_timer()
+        if self._processing:
+            # Jobs are being processed right now, run one more pass
+            # afterwards to pick up changes made in the meantime
+            self._wakeup_pending = True
+            return
+        self._processing = self._eventloop.run_in_executor(
+            self._db_executor, self._process_jobs)
+        self._processing.add_done_callback(self._jobs_processed)
+
+    def _jobs_processed(self, future):
+        self._processing = None
+        if self.state == STATE_STOPPED or future.cancelled():
+            return
+        if self._wakeup_pending:
+            self._wakeup_pending = False
+            self.wakeup()
+            return
+        try:
+            wait_seconds = future.result()
+        except Exception:
+            self._logger.exception("Error processing jobs")
+            wait_seconds = self.jobstore_retry_interval
+        self._start_timer(wait_seconds)
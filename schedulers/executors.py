@@ -0,0 +1,63 @@
+import multiprocessing
+import concurrent.futures
+
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.executors.pool import BasePoolExecutor, ThreadPoolExecutor
+
+from schedulers.asyncio_scheduler import ThreadSafeAsyncIOExecutor
+
+
+class SpawnProcessPoolExecutor(BasePoolExecutor):
+    """
+    Process pool executor which starts workers with the "spawn" method.
+
+    Forked workers would inherit the event loop, pooled database
+    connections and sockets of the web application.
+    """
+
+    def __init__(self, max_workers=10):
+        self.max_workers = int(max_workers)
+        super(SpawnProcessPoolExecutor, self).__init__(self._create_pool())
+
+    def restart(self):
+        """Replaces worker processes, running jobs finish in the old ones."""
+        pool, self._pool = self._pool, self._create_pool()
+        pool.shutdown(wait=False)
+
+    def _create_pool(self):
+        return concurrent.futures.ProcessPoolExecutor(
+            self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"))
+
+
+def is_pool_executor(profile):
+    """Checks if jobs of executor profile run outside of the event loop."""
+    return profile["type"] in ("threadpool", "processpool")
+
+
+def restart_process_pools(scheduler):
+    """Restarts process pool executors of the scheduler, so their workers
+    import job modules again.
+    """
+    with scheduler._executors_lock:
+        executors = list(scheduler._executors.values())
+    for executor in executors:
+        if isinstance(executor, SpawnProcessPoolExecutor):
+            executor.restart()
+
+
+def create_executors(profiles, non_blocking=False):
+    """Creates scheduler executors from config.EXECUTORS profiles."""
+    executors = {}
+    for alias, profile in profiles.items():
+        if profile["type"] == "asyncio":
+            executors[alias] = (ThreadSafeAsyncIOExecutor() if non_blocking
+                                else AsyncIOExecutor())
+        elif profile["type"] == "threadpool":
+            executors[alias] = ThreadPoolExecutor(profile["max_workers"])
+        elif profile["type"] == "processpool":
+            executors[alias] = SpawnProcessPoolExecutor(
+                profile["max_workers"])
+        else:
+            raise ValueError("Unknown executor type %s" % profile["type"])
+    return executors
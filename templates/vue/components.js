@@ -107,7 +107,7 @@ Vue.component('job-form', {
             moduleDescription: this.moduleDescription,
         }
     },
-    props: {job: Object, jobTriggers: Array, availableJobs: Array, isUpdate: Boolean, cancelTo: String},
+    props: {job: Object, jobTriggers: Array, availableJobs: Array, jobExecutors: Array, isUpdate: Boolean, cancelTo: String},
     template:
         `<div>
             <h5 class="text-center">{{isUpdate ? 'Edit job ' + job.id : 'Add job'}}</h5>
@@ -132,6 +132,18 @@ Vue.component('job-form', {
                     <div v-html="getModuleDescription()">
                     </div>
                 </b-form-group>
+                <b-form-group id="" label="Job executor:" label-for="job-executor"
+                    description="Leave empty to use the executor recommended for the job module">
+                    <b-form-select
+                        id="job-executor"
+                        name="job_executor"
+                        v-model="job.executor"
+                        :options="jobExecutors"
+                        class="mb-3"
+                        value-field="name"
+                        text-field="label">
+                    </b-form-select>
+                </b-form-group>
                 <b-form-group id="" label="Job trigger/schedule:" label-for="job-trigger" :description="getTriggerDescription()">
                     <b-form-select
                         id="job-trigger"
@@ -1,14 +1,34 @@
+import io
 import os
+import sys
+import csv
+import json
 import base64
 import hashlib
+import smtplib
 import uuid
+import time
+import asyncio
+import threading
+import collections
+from types import SimpleNamespace
+from importlib import import_module
+from decimal import Decimal
+from datetime import date, datetime, timedelta
 from http import HTTPStatus
 
-import jinja2
-import aiohttp_jinja2
 import pytest
+from peewee import Model, DateTimeField, TextField
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.job import Job
+from apscheduler.events import JobExecutionEvent, EVENT_JOB_EXECUTED
+from apscheduler.executors.base import run_job
+from apscheduler.executors.pool import ThreadPoolExecutor
 
 from cryptography import fernet
 from aiohttp import web
@@ -18,13 +38,32 @@ from pytz import utc
 
 import config
 from views import routes
+from auth import TokenAuth
 from utils import (setup_routes, setup_middlewares, get_log, init_app,
-                   close_app, setup_template_functions)
+                   close_app, create_template_env, convert_types, json_dumps,
+                   json_response)
 from middlewares import middlewares
 from jobstores.peewee_jobstore import PeeweeJobStore
-from models import async_db_manager, User, UserLog
-from constants import ControllerResult, Permission, LogType
+from jobstores.listener import JobChangesListener
+from schedulers.asyncio_scheduler import (NonBlockingAsyncIOScheduler,
+                                          ThreadSafeAsyncIOExecutor)
+from schedulers.executors import create_executors, SpawnProcessPoolExecutor
+from models import (async_db_manager, apscron_db, User, UserLog, JobLog,
+                    ErrorLog, APSchedulerJob, RevokedToken,
+                    add_trigram_indexes, create_indexes,
+                    trigram_indexes)
+from partitions import LogPartitioner
+from responses import ControllerResponse
+from constants import ControllerResult, Permission, LogType, AvailableJob
 from exceptions import MethodNotAllowedException
+from clients import SMTPMailer, ClientSessionRegistry, DNSResolver
+from cache import TTLCache
+from log_writer import BufferedLogWriter
+from revocation import RevocationStore
+from passwords import PasswordHasher
+import jobs
+from jobs import setup_jobs, get_report_env, JobRegistry
+from jobs.job_utils import build_email, bounded_fan_out
 
 
 def create_example_app():
@@ -41,12 +80,7 @@ def create_example_app():
         secret_key, cookie_name=config.COOKIE_NAME, max_age=config.MAX_AGE))
 
     # Setup template environment and functions
-    jinja_env = aiohttp_jinja2.setup(
-        app,
-        loader=jinja2.FileSystemLoader(config.DIRS["TEMPLATE_DIR"]),
-        context_processors=[aiohttp_jinja2.request_processor])
-
-    setup_template_functions(jinja_env)
+    create_template_env(app)
 
     jobstores = {
         "default": PeeweeJobStore()
@@ -77,9 +111,59 @@ def create_example_app():
 
     # Set up application middlewares
     setup_middlewares(app, middlewares)
+
+    # Give jobs access to application objects
+    setup_jobs(app)
     return app
 
 
+class StandInSMTPServer(object):
+    """Minimal SMTP server storing received messages, without TLS/AUTH."""
+
+    def __init__(self, refused=()):
+        self.messages = []
+        self.connections = 0
+        self.refused = set(refused)
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        writer.write(b"220 localhost ESMTP\r\n")
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode().strip().upper()
+            if command.startswith("EHLO"):
+                writer.write(b"250 localhost\r\n")
+            elif command == "DATA":
+                writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                await writer.drain()
+                data = await reader.readuntil(b"\r\n.\r\n")
+                self.messages.append(data)
+                writer.write(b"250 OK\r\n")
+            elif (command.startswith("RCPT TO:") and
+                    command[8:].strip("<> ").lower() in self.refused):
+                writer.write(b"550 No such user\r\n")
+            elif command == "QUIT":
+                writer.write(b"221 Bye\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"250 OK\r\n")
+            await writer.drain()
+        writer.close()
+
+
 username = str(uuid.uuid4())
 user = User.get_or_none(username=username)
 if not user:
@@ -110,6 +194,19 @@ async def get_token_auth_header(client):
     return {"Authorization": "Bearer %s" % token}
 
 
+async def login(client, login_data):
+    resp = await client.post("/auth/login", json=login_data)
+    data = await resp.json()
+    assert data["ok"] == ControllerResult.Success
+    return {"Authorization": "Bearer %s" % data["data"]["token"]}
+
+
+async def flush_logs(client):
+    """Writes logs buffered by the application log writers."""
+    for writer in client.server.app["log_writers"].values():
+        await writer.flush()
+
+
 @pytest.fixture
 def client(loop, aiohttp_client):
     app = create_example_app()
@@ -164,6 +261,7 @@ async def test_post_users_add_and_users_delete(client):
     assert data["data"]["is_admin"] == user_data["is_admin"]
     assert data["data"]["is_active"] == user_data["is_active"]
     assert data["data"]["permissions"] == user_data["permissions"]
+    await flush_logs(client)
     log = UserLog.get_or_none(
         user_id=user.id, log_type=LogType.UserAddView.id)
     assert log is not None
@@ -178,6 +276,7 @@ async def test_post_users_add_and_users_delete(client):
     assert len(messages)
     assert messages[0].get(
         "message") == "User %s has been deleted" % user_data["username"]
+    await flush_logs(client)
     log = UserLog.get_or_none(
         user_id=user.id, log_type=LogType.UserDeleteView.id)
     assert log is not None
@@ -203,6 +302,7 @@ async def test_get_users_list(client):
     assert user_data["permissions"] == user.permissions
     assert user_data["is_admin"] == user.is_admin
     assert user_data["is_active"] == user.is_active
+    await flush_logs(client)
     log = UserLog.get_or_none(
         user_id=user.id, log_type=LogType.UserListView.id)
     assert log is None
@@ -219,6 +319,46 @@ async def test_get_users_list(client):
     assert data["data"] is None
 
 
+def old_json_dumps(obj):
+    """Encodes obj like responses were encoded before json_dumps."""
+    return json.dumps(obj, default=convert_types, separators=(",", ":"),
+                      ensure_ascii=False).encode("utf-8")
+
+
+def test_json_dumps_matches_json_encoder():
+    data = {"created_at": datetime(2026, 1, 2, 3, 4, 5, 678),
+            "finished_at": utc.localize(datetime(2026, 1, 2, 3, 4, 5)),
+            "day": date(2026, 1, 2),
+            "amounts": [Decimal("1.50"), Decimal("0.1"), 2.5],
+            "counts": {1: "a", 2.5: "b", False: "c", None: "d"},
+            "items": [{"id": 1, "username": "\u00e4", "ip_list": []}]}
+    response = ControllerResponse(ControllerResult.Success, data=data)
+    assert json_dumps(response) == old_json_dumps(response)
+    web_response = json_response(response, status=HTTPStatus.CREATED)
+    assert web_response.status == HTTPStatus.CREATED
+    assert web_response.content_type == "application/json"
+    assert json.loads(web_response.body) == json.loads(
+        json.dumps(response, default=convert_types))
+
+
+async def test_users_list_is_encoded_as_before(client):
+    auth_header = await get_token_auth_header(client)
+    resp = await client.get(
+        "/users", headers=auth_header, params={"id": user.id})
+    assert resp.status == HTTPStatus.OK
+    data = json.loads(await resp.read())
+    assert list(data) == ["ok", "data", "messages"]
+    assert set(data["data"]) == {"items", "filters", "pagination"}
+    with apscron_db.connection_context():
+        users = list(User.select(
+            User.id, User.username, User.created_at, User.last_login_at,
+            User.ip_list, User.permissions, User.is_admin, User.is_active
+        ).where(User.id == user.id).dicts())
+    assert data["data"]["items"] == json.loads(old_json_dumps(users))
+    assert data["data"]["items"][0]["created_at"] == users[0][
+        "created_at"].strftime("%Y-%m-%d %H:%M:%S")
+
+
 async def test_get_and_put_users_edit(client):
     auth_header = await get_token_auth_header(client)
     resp = await client.get("/users/%s" % user.id, headers=auth_header)
@@ -234,6 +374,7 @@ async def test_get_and_put_users_edit(client):
     assert user_data["permissions"] == user.permissions
     assert user_data["is_admin"] == user.is_admin
     assert user_data["is_active"] == user.is_active
+    await flush_logs(client)
     log = UserLog.get_or_none(
         user_id=user.id, log_type=LogType.UserGetView.id)
     assert log is None
@@ -256,6 +397,7 @@ async def test_get_and_put_users_edit(client):
     assert user_data["permissions"] == user.permissions
     assert user_data["is_admin"] is False
     assert user_data["is_active"] is True
+    await flush_logs(client)
     log = (UserLog.
            select().
            where(UserLog.user_id == user.id,
@@ -284,6 +426,7 @@ async def test_post_jobs_and_jobs_delete(client):
         "message") == "New job %s has been added" % data["data"]["job_id"]
     assert data["data"]["job_name"] == job_data["name"]
     assert data["data"]["job_kwargs"] == job_data["kwargs"]
+    await flush_logs(client)
     log = UserLog.get_or_none(
         user_id=user.id, log_type=LogType.JobAddView.id)
     assert log is not None
@@ -298,6 +441,7 @@ async def test_post_jobs_and_jobs_delete(client):
     assert len(messages)
     assert messages[0].get(
         "message") == "Job %s has been deleted" % job_id
+    await flush_logs(client)
     log = UserLog.get_or_none(
         user_id=user.id, log_type=LogType.JobDeleteView.id)
     assert log is not None
@@ -347,6 +491,7 @@ async def test_get_and_put_job(client):
     assert messages[0].get(
         "message") == "Job %s has been updated" % data["data"]["job_id"]
     assert job_data["job_name"] == request_data["name"]
+    await flush_logs(client)
     log = (UserLog.
            select().
            where(UserLog.user_id == user.id,
@@ -384,6 +529,7 @@ async def test_pause_and_resume_job(client):
     assert len(messages)
     assert messages[0].get(
         "message") == "Job %s has been paused" % job_id
+    await flush_logs(client)
     log = UserLog.get_or_none(
         user_id=user.id, log_type=LogType.JobPauseView.id)
     assert log is not None
@@ -397,7 +543,1000 @@ async def test_pause_and_resume_job(client):
     assert len(messages)
     assert messages[0].get(
         "message") == "Job %s has been resumed" % job_id
+    await flush_logs(client)
     log = UserLog.get_or_none(
         user_id=user.id, log_type=LogType.JobPauseView.id)
     assert log is not None
     assert log.request_method == "POST"
+
+
+async def test_get_user_logs_with_cursor(client, monkeypatch):
+    monkeypatch.setattr(config, "ITEMS_PER_PAGE", 2)
+    auth_header = await get_token_auth_header(client)
+    for _ in range(3):
+        await get_token_auth_header(client)
+    await flush_logs(client)
+    # Login logs are written without user
+    request_params = {"log_type": LogType.UserLoginView.id}
+    resp = await client.get(
+        "/logs/users", headers=auth_header, params=request_params)
+    assert resp.status == HTTPStatus.OK
+    data = await resp.json()
+    assert data["ok"] == ControllerResult.Success
+    first_page = data["data"]["items"]
+    assert len(first_page) == 2
+    next_cursor = data["data"]["pagination"]["next_cursor"]
+    assert next_cursor is not None
+    request_params["cursor"] = next_cursor
+    resp = await client.get(
+        "/logs/users", headers=auth_header, params=request_params)
+    assert resp.status == HTTPStatus.OK
+    data = await resp.json()
+    assert data["ok"] == ControllerResult.Success
+    second_page = data["data"]["items"]
+    assert len(second_page)
+    assert not {log["id"] for log in first_page} & {
+        log["id"] for log in second_page}
+    assert first_page[-1]["created_at"] >= second_page[0]["created_at"]
+    request_params["cursor"] = "invalid"
+    resp = await client.get(
+        "/logs/users", headers=auth_header, params=request_params)
+    data = await resp.json()
+    assert data["ok"] == ControllerResult.Failure
+
+
+async def test_short_text_filters_are_rejected(client):
+    auth_header = await get_token_auth_header(client)
+    min_length = config.LOG_SEARCH_CONFIG["min_length"]
+    resp = await client.get(
+        "/logs/users", headers=auth_header,
+        params={"request_url": "x" * (min_length - 1)})
+    data = await resp.json()
+    assert data["ok"] == ControllerResult.Failure
+    assert "request_url" in data["messages"][0]["message"]
+    resp = await client.get(
+        "/logs/users", headers=auth_header,
+        params={"request_url": "/logs"})
+    data = await resp.json()
+    assert data["ok"] == ControllerResult.Success
+
+
+async def test_smtp_mailer_reuses_connection(loop):
+    smtp_server = StandInSMTPServer()
+    port = await smtp_server.start()
+    mailer = SMTPMailer("127.0.0.1", port, use_tls=False, connections=1)
+    await mailer.start()
+    dest_to = ["user@your_mail_server.com"]
+    for i in range(3):
+        message = build_email("Test %s" % i, "Test", config.SMTP_USER,
+                              dest_to)
+        await mailer.send(message, config.SMTP_USER, dest_to)
+    await mailer.close()
+    await smtp_server.close()
+    assert len(smtp_server.messages) == 3
+    assert smtp_server.connections == 1
+
+
+async def test_smtp_mailer_keeps_connection_of_refused_message(loop):
+    refused_to = ["missing@your_mail_server.com"]
+    smtp_server = StandInSMTPServer(refused=refused_to)
+    port = await smtp_server.start()
+    mailer = SMTPMailer("127.0.0.1", port, use_tls=False, connections=1)
+    await mailer.start()
+    dest_to = ["user@your_mail_server.com"]
+    for send_to in (dest_to, refused_to, dest_to):
+        message = build_email("Test", "Test", config.SMTP_USER, send_to)
+        if send_to is refused_to:
+            with pytest.raises(smtplib.SMTPRecipientsRefused):
+                await mailer.send(message, config.SMTP_USER, send_to)
+        else:
+            await mailer.send(message, config.SMTP_USER, send_to)
+    await mailer.close()
+    await smtp_server.close()
+    assert len(smtp_server.messages) == 2
+    assert smtp_server.connections == 1
+
+
+async def test_job_email_without_mailer_is_sent_in_thread(loop, monkeypatch):
+    sent_by = []
+
+    def send_email(*args, **kwargs):
+        sent_by.append(threading.get_ident())
+    monkeypatch.setattr(jobs, "send_email", send_email)
+    await jobs.BaseJobController().send_email(
+        "Test", "Test", ["user@your_mail_server.com"])
+    assert len(sent_by) == 1
+    assert sent_by[0] != threading.get_ident()
+
+
+async def test_export_user_logs(client, monkeypatch):
+    monkeypatch.setattr(config, "LOG_EXPORT_BATCH_SIZE", 2)
+    auth_header = await get_token_auth_header(client)
+    for _ in range(3):
+        await get_token_auth_header(client)
+    await flush_logs(client)
+    resp = await client.get(
+        "/logs/users/export", headers=auth_header,
+        params={"log_type": LogType.UserLoginView.id, "format": "ndjson"})
+    assert resp.status == HTTPStatus.OK
+    assert resp.content_type == "application/x-ndjson"
+    logs = [json.loads(line) for line in (await resp.text()).splitlines()]
+    assert len(logs) >= 4
+    assert len({log["id"] for log in logs}) == len(logs)
+    assert all(log["log_type"] == LogType.UserLoginView.id for log in logs)
+    resp = await client.get(
+        "/logs/users/export", headers=auth_header,
+        params={"log_type": LogType.UserLoginView.id, "format": "csv"})
+    assert resp.status == HTTPStatus.OK
+    rows = list(csv.reader(io.StringIO(await resp.text())))
+    assert rows[0][0] == "id"
+    assert len(rows) == len(logs) + 1
+    resp = await client.get("/logs/unknown/export", headers=auth_header)
+    assert resp.status == HTTPStatus.NOT_FOUND
+
+
+def explain(query):
+    """Gets query plan, preferring any usable index to sequential scans."""
+    sql, params = query.sql()
+    with apscron_db.connection_context():
+        with apscron_db.atomic():
+            apscron_db.execute_sql("SET LOCAL enable_seqscan = off")
+            cursor = apscron_db.execute_sql("EXPLAIN " + sql, params)
+            return "\n".join(row[0] for row in cursor.fetchall())
+
+
+def test_log_filters_use_indexes():
+    started, ended = datetime(2026, 1, 1), datetime(2026, 2, 1)
+    user_log_order = (UserLog.created_at.desc(), UserLog.id.desc())
+    job_log_order = (JobLog.started_at.desc(), JobLog.id.desc())
+    queries = [
+        (UserLog.select().where(UserLog.user == user.id)
+         .order_by(*user_log_order), "user_id ="),
+        # Logins are most of the test logs, planner rightly scans them in
+        # created_at order, rare log types are looked up by index
+        (UserLog.select().where(UserLog.log_type << [
+            LogType.UserEditView.id, LogType.UserDeleteView.id])
+         .order_by(*user_log_order), "log_type ="),
+        (UserLog.select().where(UserLog.created_at.between(started, ended))
+         .order_by(*user_log_order), "created_at >="),
+        (JobLog.select().where(JobLog.user == user.id)
+         .order_by(*job_log_order), "user_id ="),
+        (JobLog.select().where(JobLog.started_at.between(started, ended))
+         .order_by(*job_log_order), "started_at >="),
+        (JobLog.select().where(JobLog.finished_at.between(started, ended))
+         .order_by(*job_log_order), "finished_at >="),
+        (ErrorLog.select().where(ErrorLog.created_at.between(started, ended))
+         .order_by(ErrorLog.created_at.desc(), ErrorLog.id.desc()),
+         "created_at >="),
+    ]
+    for query, index_condition in queries:
+        plan = explain(query.limit(config.ITEMS_PER_PAGE))
+        assert "Seq Scan" not in plan, plan
+        assert any("Index Cond" in line and index_condition in line
+                   for line in plan.splitlines()), plan
+
+
+def test_indexes_are_created_concurrently():
+    table = "test_searched_logs"
+
+    class SearchedLog(Model):
+        message = TextField()
+        created_at = DateTimeField()
+
+        class Meta:
+            database = apscron_db
+            table_name = table
+            indexes = ((("created_at", "id"), False),)
+            dropped_indexes = (table + "_replaced",)
+
+    add_trigram_indexes(SearchedLog, "message")
+    index_name = SearchedLog._meta.fields_to_index()[0]._name
+
+    def get_indexes():
+        cursor = apscron_db.execute_sql(
+            "SELECT indexrelid::regclass::text, indisvalid, indisunique "
+            "FROM pg_index WHERE indrelid = to_regclass(%s) "
+            "AND NOT indisprimary", (table,))
+        return {row[0]: row[1:] for row in cursor.fetchall()}
+
+    with apscron_db.connection_context():
+        # Table of an existing deployment, without the model indexes
+        SearchedLog._schema.create_table()
+        try:
+            SearchedLog.insert_many(
+                [{"message": "test", "created_at": datetime(2026, 1, 1)}] * 2
+            ).execute()
+            apscron_db.execute_sql('CREATE INDEX "%s_replaced" ON "%s" '
+                                   '(created_at)' % (table, table))
+            # Interrupted concurrent builds leave invalid indexes behind
+            connection = apscron_db.connection()
+            connection.autocommit = True
+            try:
+                with pytest.raises(Exception):
+                    connection.cursor().execute(
+                        'CREATE UNIQUE INDEX CONCURRENTLY "%s" ON "%s" '
+                        '(created_at)' % (index_name, table))
+            finally:
+                connection.autocommit = False
+            assert get_indexes()[index_name] == (False, True)
+            for _ in range(2):
+                create_indexes(SearchedLog)
+                assert get_indexes() == {
+                    index_name: (True, False),
+                    table + "_message_trgm": (True, False)}
+        finally:
+            SearchedLog.drop_table()
+            trigram_indexes.pop(SearchedLog)
+
+
+def test_log_partitioner_creates_and_drops_partitions():
+    table = "test_partitioned_logs"
+
+    class PartitionedLog(Model):
+        created_at = DateTimeField()
+
+        class Meta:
+            database = apscron_db
+            table_name = table
+            primary_key = False
+            table_settings = ["PARTITION BY RANGE (created_at)"]
+
+    def get_partitions():
+        cursor = apscron_db.execute_sql(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass", (table,))
+        return {row[0] for row in cursor.fetchall()}
+
+    partitioner = LogPartitioner(
+        apscron_db, [PartitionedLog], premake=1, retention=1)
+    with apscron_db.connection_context():
+        PartitionedLog.create_table()
+    try:
+        partitioner.maintain(now=datetime(2026, 1, 15))
+        with apscron_db.connection_context():
+            assert get_partitions() == {
+                table + "_default", table + "_p202601", table + "_p202602"}
+        partitioner.maintain(now=datetime(2026, 4, 10))
+        with apscron_db.connection_context():
+            assert get_partitions() == {
+                table + "_default", table + "_p202604", table + "_p202605"}
+    finally:
+        with apscron_db.connection_context():
+            PartitionedLog.drop_table()
+
+
+def test_log_partitioner_deletes_expired_rows_of_unpartitioned_tables():
+    class UnpartitionedLog(Model):
+        created_at = DateTimeField(index=True)
+
+        class Meta:
+            database = apscron_db
+            table_name = "test_unpartitioned_logs"
+            partition_column = "created_at"
+
+    partitioner = LogPartitioner(
+        apscron_db, [UnpartitionedLog], retention=1, delete_batch_size=2)
+    with apscron_db.connection_context():
+        UnpartitionedLog.create_table()
+        UnpartitionedLog.insert_many(
+            [{"created_at": datetime(2026, 1, day)} for day in (1, 2, 3)] +
+            [{"created_at": datetime(2026, 2, 1)},
+             {"created_at": datetime(2026, 3, 5)}]).execute()
+    try:
+        partitioner.maintain(now=datetime(2026, 3, 10))
+        with apscron_db.connection_context():
+            assert [log.created_at for log in UnpartitionedLog.select()
+                    .order_by(UnpartitionedLog.created_at)] == [
+                datetime(2026, 2, 1), datetime(2026, 3, 5)]
+    finally:
+        with apscron_db.connection_context():
+            UnpartitionedLog.drop_table()
+
+
+def noop_job():
+    pass
+
+
+class SlowJobStore(MemoryJobStore):
+    """Memory job store with a slow scheduler tick."""
+
+    def get_due_jobs(self, now):
+        time.sleep(0.5)
+        return super(SlowJobStore, self).get_due_jobs(now)
+
+
+async def test_slow_jobstore_tick_does_not_block_loop(loop):
+    scheduler = NonBlockingAsyncIOScheduler(
+        jobstores={"default": SlowJobStore()},
+        executors={"default": ThreadSafeAsyncIOExecutor()}, timezone=utc)
+    scheduler.start()
+    # Let the first tick take the job stores lock in the worker thread
+    await asyncio.sleep(0.05)
+    started_at = time.monotonic()
+    add_job = scheduler.run_in_db_executor(
+        scheduler.add_job, noop_job, "interval", id="noop", hours=1)
+    max_latency = 0
+    while not add_job.done():
+        tick = time.monotonic()
+        await asyncio.sleep(0.01)
+        max_latency = max(max_latency, time.monotonic() - tick - 0.01)
+    await add_job
+    scheduler.shutdown(wait=False)
+    # add_job waited for the tick, the event loop didn't
+    assert time.monotonic() - started_at > 0.3
+    assert max_latency < 0.1
+    assert scheduler.get_job("noop") is not None
+
+
+def create_job(job_id, next_run_time, **kwargs):
+    return Job(BackgroundScheduler(timezone=utc), id=job_id, func=noop_job,
+               trigger=IntervalTrigger(hours=1, timezone=utc),
+               executor="default", args=(), kwargs=kwargs, name=job_id,
+               misfire_grace_time=1, coalesce=True, max_instances=1,
+               next_run_time=next_run_time)
+
+
+class StandInAPSchedulerJob(APSchedulerJob):
+
+    class Meta:
+        table_name = "test_apscheduler_jobs"
+
+
+def get_next_run_time(job_id):
+    return (StandInAPSchedulerJob
+            .select(StandInAPSchedulerJob.next_run_time)
+            .where(StandInAPSchedulerJob.id == job_id)
+            .scalar())
+
+
+@pytest.fixture
+def jobstores():
+    """Creates started job stores sharing a table of their own."""
+    scheduler = BackgroundScheduler(timezone=utc)
+
+    def create_jobstore(**kwargs):
+        jobstore = PeeweeJobStore(jobs_t=StandInAPSchedulerJob, **kwargs)
+        jobstore.start(scheduler, "default")
+        return jobstore
+    yield create_jobstore
+    StandInAPSchedulerJob.drop_table()
+
+
+def test_batched_job_updates(jobstores, monkeypatch):
+    jobstore = jobstores(batch_updates=True)
+    now = datetime.now(utc)
+    for job_id in ("jobstore_a", "jobstore_b"):
+        jobstore.add_job(create_job(job_id, now - timedelta(seconds=1)))
+    due_jobs = jobstore.get_due_jobs(now)
+    assert {job.id for job in due_jobs} == {"jobstore_a", "jobstore_b"}
+    for job in due_jobs:
+        job._modify(next_run_time=now + timedelta(hours=1))
+        jobstore.update_job(job)
+    # Updates are written when the scheduler asks for the next run time
+    assert get_next_run_time("jobstore_a") < now.timestamp()
+    # Job removed by another node in the meantime is skipped
+    (StandInAPSchedulerJob
+        .delete()
+        .where(StandInAPSchedulerJob.id == "jobstore_b")
+        .execute())
+    assert jobstore.get_next_run_time() is not None
+    assert get_next_run_time("jobstore_a") > now.timestamp()
+    assert not jobstore._pending_updates
+
+    # Missing job updated while batching is reported right away
+    jobstore.get_due_jobs(now)
+    with pytest.raises(JobLookupError):
+        jobstore.update_job(create_job("jobstore_missing", now))
+
+    # Failed updates are kept and due jobs are not read meanwhile
+    due_jobs = jobstore.get_due_jobs(now + timedelta(hours=2))
+    assert [job.id for job in due_jobs] == ["jobstore_a"]
+    due_jobs[0]._modify(next_run_time=now + timedelta(hours=3))
+    jobstore.update_job(due_jobs[0])
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("Connection lost")
+    monkeypatch.setattr(apscron_db, "execute_sql", fail)
+    with pytest.raises(RuntimeError):
+        jobstore.get_due_jobs(now + timedelta(hours=2))
+    assert not jobstore._batching
+    assert "jobstore_a" in jobstore._pending_updates
+    monkeypatch.undo()
+    assert not jobstore.get_due_jobs(now + timedelta(hours=2))
+    assert get_next_run_time("jobstore_a") > (
+        now + timedelta(hours=2)).timestamp()
+
+
+def test_failed_job_update_is_written_again(jobstores, monkeypatch):
+    jobstore = jobstores(compact_state=True)
+    now = datetime.now(utc)
+    job = create_job("jobstore_a", now)
+    jobstore.add_job(job)
+    job._modify(trigger=IntervalTrigger(minutes=5, timezone=utc))
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("Connection lost")
+    monkeypatch.setattr(apscron_db, "execute_sql", fail)
+    with pytest.raises(RuntimeError):
+        jobstore.update_job(job)
+    monkeypatch.undo()
+    jobstore.update_job(job)
+    restored = jobstores().lookup_job("jobstore_a")
+    assert restored.trigger.interval == timedelta(minutes=5)
+
+
+async def test_jobs_are_listed_from_summaries(client, monkeypatch):
+    auth_header = await get_token_auth_header(client)
+    scheduler = client.server.app["apscheduler"]
+    job_id = "test_job__%s" % uuid.uuid4()
+    job = scheduler.add_job(
+        "jobs.test_job:APSJob.job_import",
+        IntervalTrigger(hours=1, timezone="Asia/Tokyo"), id=job_id,
+        name=job_id, args=["jobs.test_job", job_id, user.id])
+
+    def restore_job(jobstore, row):
+        raise AssertionError("Job %s was restored" % row.id)
+    monkeypatch.setattr(PeeweeJobStore, "_reconstitute_job", restore_job)
+    resp = await client.get(
+        "/jobs", headers=auth_header, params={"id": job_id})
+    data = await resp.json()
+    assert data["ok"] == ControllerResult.Success
+    items = data["data"]["items"]
+    assert [item["id"] for item in items] == [job_id]
+    # Next run time is shown in trigger timezone
+    assert items[0]["next_run_time"] == job.next_run_time.strftime(
+        "%Y-%m-%d %H:%M:%S")
+    assert items[0]["module"] == "test_job"
+    assert items[0]["user_id"] == user.id
+    resp = await client.delete("/jobs/%s" % job_id, headers=auth_header)
+    data = await resp.json()
+    assert data["ok"] == ControllerResult.Success
+
+
+class StandInScheduler(object):
+    """Records scheduler wakeups."""
+
+    def __init__(self):
+        self.woken_up = asyncio.Event()
+
+    def wakeup(self):
+        self.woken_up.set()
+
+
+async def test_job_changes_of_other_nodes_invalidate_cache(loop, jobstores):
+    channel = "apscron_test_jobs"
+    jobstore = jobstores(cache_jobs=True, notify_channel=channel)
+    other_jobstore = jobstores(notify_channel=channel)
+    other_jobstore.node_id = "other_node"
+    jobstore.add_job(create_job(
+        "jobstore_a", datetime.now(utc) + timedelta(hours=1)))
+    scheduler = StandInScheduler()
+    listener = JobChangesListener(
+        scheduler, jobstore, apscron_db, wakeup_delay=0.01)
+    await listener.start()
+    try:
+        for _ in range(100):
+            if listener._reconnected:
+                break
+            await asyncio.sleep(0.05)
+        job = other_jobstore.lookup_job("jobstore_a")
+        job._modify(trigger=IntervalTrigger(minutes=5, timezone=utc))
+        other_jobstore.update_job(job)
+        await asyncio.wait_for(scheduler.woken_up.wait(), 5)
+    finally:
+        await listener.close()
+    assert jobstore._stale_job_ids == {"jobstore_a"}
+    job = jobstore.lookup_job("jobstore_a")
+    assert job.trigger.interval == timedelta(minutes=5)
+    assert not jobstore._stale_job_ids
+
+
+def test_only_changed_jobs_are_notified(jobstores, monkeypatch):
+    now = datetime.now(utc)
+    for batch_updates in (False, True):
+        jobstore = jobstores(batch_updates=batch_updates,
+                             notify_channel="apscron_test_jobs")
+        job_id = "jobstore_%s" % batch_updates
+        jobstore.add_job(create_job(job_id, now - timedelta(seconds=1)))
+        notified = []
+        monkeypatch.setattr(jobstore, "_notify", notified.append)
+        # Next run time moved by the scheduler is not notified
+        job, = jobstore.get_due_jobs(now)
+        job._modify(next_run_time=now + timedelta(hours=1))
+        jobstore.update_job(job)
+        jobstore.get_next_run_time()
+        assert get_next_run_time(job_id) > now.timestamp()
+        assert notified == []
+        # Changed definition is
+        job, = jobstore.get_due_jobs(now + timedelta(hours=2))
+        job._modify(next_run_time=now + timedelta(hours=3),
+                    trigger=IntervalTrigger(minutes=5, timezone=utc))
+        jobstore.update_job(job)
+        jobstore.get_next_run_time()
+        assert notified == [job_id]
+        # Paused job is
+        job._modify(next_run_time=None)
+        jobstore.update_job(job)
+        assert notified == [job_id, job_id]
+        jobstore.remove_job(job_id)
+
+
+def claim_jobs(jobstore, now, barrier=None):
+    if barrier:
+        barrier.wait()
+    try:
+        return {job.id for job in jobstore.get_due_jobs(now)}
+    finally:
+        if barrier:
+            apscron_db.close()
+
+
+def test_claimed_jobs_are_leased_until_they_finish(jobstores):
+    jobstore = jobstores(claim_jobs=True, lease_seconds=60, claim_limit=10)
+    other_jobstore = jobstores(
+        claim_jobs=True, lease_seconds=60, claim_limit=10)
+    other_jobstore.node_id = "other_node"
+    now = datetime.now(utc)
+    job_ids = {"jobstore_%s" % i for i in range(20)}
+    for job_id in job_ids:
+        jobstore.add_job(create_job(job_id, now - timedelta(seconds=1)))
+
+    # Nodes claiming at once split due jobs between them
+    barrier = threading.Barrier(2)
+    claimed = [None, None]
+
+    def claim(i, store):
+        claimed[i] = claim_jobs(store, now, barrier)
+    threads = [threading.Thread(target=claim, args=(i, store))
+               for i, store in enumerate((jobstore, other_jobstore))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(claimed[0]) == len(claimed[1]) == 10
+    assert not claimed[0] & claimed[1]
+    assert claimed[0] | claimed[1] == job_ids
+    jobstore.claim_limit = other_jobstore.claim_limit = None
+
+    # Rescheduled job stays leased while it runs
+    job_id = sorted(claimed[0])[0]
+    job = jobstore.lookup_job(job_id)
+    jobstore.update_job(job)
+    assert job_id not in claim_jobs(other_jobstore, now)
+    assert job_id in claim_jobs(jobstore, now)
+
+    # Finished job is released on next claim
+    jobstore._job_finished(JobExecutionEvent(
+        EVENT_JOB_EXECUTED, job_id, "default", now))
+    assert job_id not in claim_jobs(jobstore, now - timedelta(hours=1))
+    assert job_id in claim_jobs(other_jobstore, now)
+
+    # Jobs of a node which didn't release them are claimed after the lease
+    assert not claim_jobs(other_jobstore, now + timedelta(seconds=30)) & (
+        claimed[0] - {job_id})
+    assert claim_jobs(other_jobstore, now + timedelta(seconds=61)) == job_ids
+
+
+def test_executors_are_created_from_profiles():
+    executors = create_executors(config.EXECUTORS, non_blocking=True)
+    assert isinstance(executors["default"], ThreadSafeAsyncIOExecutor)
+    assert isinstance(executors["threadpool"], ThreadPoolExecutor)
+    assert isinstance(executors["processpool"], SpawnProcessPoolExecutor)
+    for job in AvailableJob.get_dicts():
+        assert job["executor"] in config.EXECUTORS
+
+
+async def test_job_executor_selects_job_function(client):
+    auth_header = await get_token_auth_header(client)
+    scheduler = client.server.app["apscheduler"]
+    job_data = {"name": str(uuid.uuid4()), "module": "test_job",
+                "trigger": "cron", "kwargs": {}, "year": "*", "month": "*",
+                "day": "*", "week": "*", "day_of_week": "*", "hour": "0",
+                "minute": "0", "second": "0"}
+    for executor, func in (("processpool", "APSJob.job_run"),
+                           ("threadpool", "APSJob.job_run"),
+                           ("", "APSJob.job_import")):
+        resp = await client.post("/jobs", json=dict(
+            job_data, executor=executor), headers=auth_header)
+        data = await resp.json()
+        assert data["ok"] == ControllerResult.Success
+        job = scheduler.get_job(data["data"]["job_id"])
+        scheduler.remove_job(job.id)
+        assert job.executor == (executor or "default")
+        assert job.func_ref == "jobs.test_job:%s" % func
+
+
+def test_job_run_resolves_job_in_worker_process():
+    job_id = "test_job__%s" % uuid.uuid4()
+    job = Job(BackgroundScheduler(timezone=utc), id=job_id,
+              func="jobs.test_job:APSJob.job_run",
+              trigger=IntervalTrigger(hours=1, timezone=utc),
+              executor="processpool", args=["jobs.test_job", job_id, user.id],
+              kwargs={"test": True}, name=job_id, misfire_grace_time=None,
+              coalesce=True, max_instances=1, next_run_time=None)
+    executor = SpawnProcessPoolExecutor(1)
+    try:
+        future = executor._pool.submit(
+            run_job, job, "default", [datetime.now(utc)], "apscheduler")
+        events = future.result(timeout=60)
+    finally:
+        executor.shutdown()
+    assert [event.code for event in events] == [EVENT_JOB_EXECUTED]
+    log = JobLog.get_or_none(JobLog.job_id == job_id)
+    assert log is not None
+    assert log.error is None
+    assert log.job_data == {"test": True}
+    JobLog.delete().where(JobLog.job_id == job_id).execute()
+
+
+async def test_client_sessions_are_reused_and_closed(loop):
+    sessions = ClientSessionRegistry(limit=5, limit_per_host=2)
+    session = sessions.get()
+    assert sessions.get() is session
+    assert session.connector.limit == 5
+    assert session.connector.limit_per_host == 2
+    other_session = sessions.get("other")
+    assert other_session is not session
+    # Session closed by a job is replaced
+    await session.close()
+    session = sessions.get()
+    assert not session.closed
+    await sessions.close()
+    assert session.closed
+    assert other_session.closed
+
+
+def test_ttl_cache_expires_and_evicts(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = TTLCache(10, maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=20)
+    now[0] += 10
+    assert "a" not in cache
+    assert cache.get("b") == 2
+    cache.set("c", 3)
+    cache.set("d", 4)
+    # The oldest entry is evicted
+    assert "b" not in cache
+    assert (cache.get("c"), cache.get("d")) == (3, 4)
+    assert len(cache) == 2
+
+
+async def test_dns_resolver_caches_addresses(loop, monkeypatch):
+    lookups = []
+
+    async def getaddrinfo(host, port, **kwargs):
+        lookups.append(host)
+        await asyncio.sleep(0.01)
+        return [(None, None, None, None, ("10.0.0.%s" % len(lookups), 0))]
+    monkeypatch.setattr(loop, "getaddrinfo", getaddrinfo)
+    resolver = DNSResolver(ttl=60)
+    # Concurrent lookups of a host share one getaddrinfo call
+    ips = await asyncio.gather(*(resolver.resolve("example.com")
+                                 for _ in range(3)))
+    assert ips == ["10.0.0.1"] * 3
+    assert await resolver.resolve("example.com") == "10.0.0.1"
+    assert lookups == ["example.com"]
+    resolver.remember("example.org", "10.0.1.1")
+    assert await resolver.resolve("example.org") == "10.0.1.1"
+    assert lookups == ["example.com"]
+
+
+async def test_bounded_fan_out_limits_concurrency(loop):
+    running = collections.Counter()
+    peak = collections.Counter()
+
+    async def check(item):
+        host, i = item
+        running[host] += 1
+        running["total"] += 1
+        peak[host] = max(peak[host], running[host])
+        peak["total"] = max(peak["total"], running["total"])
+        await asyncio.sleep(0.001 * (i % 3))
+        running[host] -= 1
+        running["total"] -= 1
+        if i == 0:
+            raise OSError("Connection refused")
+        return i
+
+    hosts = ["a"] * 30 + ["b"] * 10 + ["c", "d", "e", "f"]
+    items = [(host, i) for i, host in enumerate(hosts)]
+    results = [result async for result in bounded_fan_out(
+        items, check, max_concurrency=5, key=lambda item: item[0],
+        max_per_key=2)]
+    assert sorted(item for item, _, _ in results) == sorted(items)
+    assert peak["total"] == 5
+    assert max(peak[host] for host in set(hosts)) == 2
+    errors = [result for _, result, _ in results
+              if isinstance(result, Exception)]
+    assert [str(e) for e in errors] == ["Connection refused"]
+
+
+async def test_job_reports_render_alike_in_app_and_workers(client):
+    app_env = get_report_env(client.server.app)
+    worker_env = get_report_env()
+    assert app_env is not worker_env
+    failed_resp = [{"url": "http://example.com/?a=1&b=<2>", "method": "GET",
+                    "status": 500, "status_text": "Internal Server Error",
+                    "ip": "10.0.0.1"},
+                   {"url": "http://example.org", "error": "<timeout>"}]
+    reports = [env.get_template("reports/monitor_sockets.html").render(
+                   subject="Failed", failed_resp=failed_resp)
+               for env in (app_env, worker_env)]
+    assert reports[0] == reports[1]
+    assert "http://example.com/?a=1&amp;b=&lt;2&gt;" in reports[0]
+    assert "&lt;timeout&gt;" in reports[0]
+    assert "<b>Remote Address:</b> 10.0.0.1" in reports[0]
+
+
+def test_job_registry_resolves_job_classes():
+    registry = JobRegistry()
+    registry.load(["jobs.test_job"])
+    job_class = import_module("jobs.test_job").APSJob
+    assert registry.get("jobs.test_job") is job_class
+    assert registry.metadata("jobs.test_job") == {
+        "job_doc": job_class.__doc__}
+    # Unknown jobs fail like importing them did, and are not remembered
+    for _ in range(2):
+        with pytest.raises(ModuleNotFoundError):
+            registry.get("jobs.missing_job")
+    with pytest.raises(AttributeError):
+        registry.get("jobs.job_utils")
+
+
+JOB_MODULE_SOURCE = """
+class APSJob(object):
+    \"\"\"Version %s\"\"\"
+
+    def __init__(self, run_in_worker=False):
+        pass
+
+    async def call(self, *args, runs):
+        runs.append(%s)
+"""
+
+
+async def test_reloaded_job_class_is_used_by_next_run(loop, tmp_path,
+                                                      monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    job_module = "reloaded_job_%s" % uuid.uuid4().hex
+    source = tmp_path / ("%s.py" % job_module)
+    source.write_text(JOB_MODULE_SOURCE % (1, 1))
+    runs = []
+    try:
+        await jobs._import_and_call([job_module], {"runs": runs})
+        source.write_text(JOB_MODULE_SOURCE % (2, 2))
+        # Changed module is not picked up until it's reloaded
+        await jobs._import_and_call([job_module], {"runs": runs})
+        job_class = jobs.job_registry.reload(job_module)
+        assert job_class.__doc__ == "Version 2"
+        assert jobs.job_registry.metadata(job_module) == {
+            "job_doc": "Version 2"}
+        await jobs._import_and_call([job_module], {"runs": runs})
+    finally:
+        jobs.job_registry._jobs.pop(job_module, None)
+        sys.modules.pop(job_module, None)
+    assert runs == [1, 1, 2]
+
+
+async def test_reload_job_module(client):
+    auth_header = await get_token_auth_header(client)
+    job_class = import_module("jobs.test_job").APSJob
+    resp = await client.post("/jobs/reload/test_job", headers=auth_header)
+    data = await resp.json()
+    assert data["ok"] == ControllerResult.Success
+    reloaded_class = client.app["job_registry"].get("jobs.test_job")
+    assert reloaded_class is not job_class
+    assert reloaded_class is import_module("jobs.test_job").APSJob
+    resp = await client.post("/jobs/reload/job_utils", headers=auth_header)
+    data = await resp.json()
+    assert data["ok"] == ControllerResult.Failure
+
+
+def test_process_pool_restart_replaces_workers():
+    executor = SpawnProcessPoolExecutor(1)
+    pool = executor._pool
+    executor.restart()
+    try:
+        assert executor._pool is not pool
+        assert executor._pool.submit(abs, -1).result(timeout=30) == 1
+    finally:
+        executor._pool.shutdown()
+
+
+class StandInLogDatabase(object):
+    """Async database manager which can be told to fail."""
+
+    def __init__(self, db):
+        self.db = db
+        self.fail = False
+        self.inserts = 0
+
+    async def execute(self, query):
+        if self.fail:
+            raise RuntimeError("Connection lost")
+        self.inserts += 1
+        return await self.db.execute(query)
+
+
+async def test_buffered_log_writer(client, caplog):
+    db = StandInLogDatabase(client.server.app["apscron_db"])
+    writer = BufferedLogWriter(db, JobLog, max_batch=3, flush_interval=0.05,
+                               max_pending=5, metrics_interval=0.05)
+    job_id = "test_writer__%s" % uuid.uuid4()
+
+    def get_logged_items():
+        return [log.job_data["i"] for log in JobLog
+                .select()
+                .where(JobLog.job_id == job_id)
+                .order_by(JobLog.id)]
+
+    async def write(items):
+        for i in items:
+            await writer.write(job_id=job_id, job_data={"i": i})
+
+    # Rows are written once a batch is full
+    await write(range(2))
+    assert db.inserts == 0
+    await write([2])
+    await writer._flush_task
+    assert db.inserts == 1
+    assert get_logged_items() == [0, 1, 2]
+
+    # Failed flushes keep at most max_pending newest rows
+    db.fail = True
+    await write(range(3, 10))
+    assert writer.metrics["failed_flushes"] >= 1
+    assert [row["job_data"]["i"] for row in writer._rows] == [5, 6, 7, 8, 9]
+    assert writer.metrics["pending"] == 5
+
+    # Buffered rows are written on close, metrics are logged meanwhile
+    db.fail = False
+    await writer.start()
+    await asyncio.sleep(0.15)
+    await write([10])
+    await writer.close()
+    assert get_logged_items() == [0, 1, 2, 5, 6, 7, 8, 9, 10]
+    assert writer.metrics["written"] == 9
+    assert writer.metrics["pending"] == 0
+    assert "JobLog writer metrics" in caplog.text
+    JobLog.delete().where(JobLog.job_id == job_id).execute()
+
+
+async def test_edited_and_deleted_users_are_not_cached(client):
+    auth_header = await get_token_auth_header(client)
+    user_cache = client.server.app["user_cache"]
+    for action in ("edit", "delete"):
+        user_data = {"username": str(uuid.uuid4()), "password": "1",
+                     "ip_list": [], "is_admin": False, "is_active": True,
+                     "permissions": [Permission.UserListView.name]}
+        resp = await client.post(
+            "/users", json=user_data, headers=auth_header)
+        user_id = (await resp.json())["data"]["id"]
+        user_header = await login(client, {
+            "username": user_data["username"], "password": "1"})
+        resp = await client.get("/users", headers=user_header)
+        assert (await resp.json())["ok"] == ControllerResult.Success
+        assert user_id in user_cache
+        if action == "edit":
+            resp = await client.put("/users/%s" % user_id, json=dict(
+                user_data, is_active=False), headers=auth_header)
+        else:
+            resp = await client.delete(
+                "/users/%s" % user_id, headers=auth_header)
+        assert (await resp.json())["ok"] == ControllerResult.Success
+        assert user_id not in user_cache
+        resp = await client.get("/users", headers=user_header)
+        assert (await resp.json())["ok"] == ControllerResult.Failure
+        if action == "edit":
+            await client.delete("/users/%s" % user_id, headers=auth_header)
+
+
+async def test_cached_user_lists_are_not_shared(client):
+    request = SimpleNamespace(app={"user_cache": TTLCache(30)})
+    auth = TokenAuth(request)
+    # First request loads the user and caches its data
+    for _ in range(3):
+        cached_user = await auth._get_user_by_id(user.id)
+        cached_user.permissions.append("changed_by_request")
+        cached_user.ip_list.append("10.0.0.1")
+        assert "changed_by_request" not in request.app["user_cache"].get(
+            user.id)["permissions"]
+    cached_user = await auth._get_user_by_id(user.id)
+    assert cached_user.permissions == user.permissions
+    assert cached_user.ip_list == user.ip_list
+
+
+async def test_logged_out_token_is_rejected(client):
+    auth_header = await get_token_auth_header(client)
+    resp = await client.get("/users", headers=auth_header)
+    assert (await resp.json())["ok"] == ControllerResult.Success
+    resp = await client.post("/auth/logout", headers=auth_header)
+    assert (await resp.json())["ok"] == ControllerResult.Success
+    resp = await client.get("/users", headers=auth_header)
+    data = await resp.json()
+    assert data["ok"] == ControllerResult.Failure
+
+
+async def test_revoked_tokens_are_evicted_when_they_expire(loop,
+                                                          monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    store = RevocationStore()
+    for key, ttl in (("a", 30), ("b", 10), ("c", 20)):
+        await store.revoke(key, now[0] + ttl)
+    # Already expired tokens are not kept
+    await store.revoke("d", now[0])
+    assert len(store) == 3
+    now[0] += 15
+    assert not store.is_revoked("b")
+    assert store.is_revoked("a") and store.is_revoked("c")
+    now[0] += 15
+    assert len(store) == 0
+    assert not store._expiry
+
+
+async def test_revoked_tokens_are_shared_by_processes(client):
+    db = client.server.app["apscron_db"]
+    key = "test_%s" % uuid.uuid4()
+    store = RevocationStore(db, RevokedToken, sync_interval=60)
+    other_store = RevocationStore(db, RevokedToken, sync_interval=60)
+    await store.start()
+    await other_store.start()
+    try:
+        await store.revoke(key, time.time() + 60)
+        assert not other_store.is_revoked(key)
+        await other_store.sync()
+        assert other_store.is_revoked(key)
+        # Revocations are loaded on start, e.g. after a restart
+        restarted_store = RevocationStore(db, RevokedToken)
+        await restarted_store.start()
+        await restarted_store.close()
+        assert restarted_store.is_revoked(key)
+    finally:
+        await store.close()
+        await other_store.close()
+        RevokedToken.delete().where(RevokedToken.key == key).execute()
+
+
+async def test_password_hasher_verifies_legacy_hashes(loop):
+    hasher = PasswordHasher(n=512, r=8, p=1, max_workers=1)
+    await hasher.start()
+    try:
+        # Hashes stored before cost parameters were encoded
+        assert await hasher.verify("1", user.password, user.salt)
+        assert not await hasher.verify("2", user.password, user.salt)
+        assert hasher.needs_rehash(user.password)
+        encoded, salt = await hasher.hash("1")
+        assert encoded.startswith("scrypt$512$8$1$")
+        assert await hasher.verify("1", encoded, salt)
+        assert not await hasher.verify("2", encoded, salt)
+        assert not hasher.needs_rehash(encoded)
+    finally:
+        await hasher.close()
+
+
+async def test_outdated_password_hash_is_replaced_on_login(client):
+    outdated_hasher = PasswordHasher(n=512, r=8, p=1)
+    encoded, salt = outdated_hasher.hash_sync("1")
+    login_user = User.create(
+        username=str(uuid.uuid4()), password=encoded, salt=salt,
+        permissions=[], is_admin=False, is_active=True)
+    try:
+        login_data = {"username": login_user.username, "password": "2"}
+        resp = await client.post("/auth/login", json=login_data)
+        assert (await resp.json())["ok"] == ControllerResult.Failure
+        assert User.get_or_none(id=login_user.id).password == encoded
+        await login(client, dict(login_data, password="1"))
+        rehashed_user = User.get_or_none(id=login_user.id)
+        assert rehashed_user.password.startswith("scrypt$%s$%s$%s$" % (
+            config.PASSWORD_HASHER_CONFIG["n"],
+            config.PASSWORD_HASHER_CONFIG["r"],
+            config.PASSWORD_HASHER_CONFIG["p"]))
+        assert rehashed_user.salt != salt
+        await login(client, dict(login_data, password="1"))
+    finally:
+        login_user.delete_instance(recursive=True)
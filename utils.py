@@ -4,11 +4,21 @@ import datetime
 from http import HTTPStatus
 from urllib.parse import urljoin
 
+import jinja2
+import orjson
+import aiohttp_jinja2
 from aiohttp import web
 
 import config
 from constants import ControllerResult, BSVariant
 from responses import ControllerResponse
+from clients import ClientSessionRegistry, DNSResolver
+from log_writer import BufferedLogWriter
+from cache import TTLCache
+from models import (JobLog, UserLog, ErrorLog, RevokedToken,
+                    get_log_partitioner)
+from revocation import RevocationStore
+from passwords import PasswordHasher
 
 
 def setup_routes(app, routes):
@@ -60,17 +70,68 @@ async def init_app(app):
     # Connect to db connection pool
     if not app["apscron_db"].is_connected:
         await app["apscron_db"].connect()
+    # Log rows are buffered and written in batches by background writers
+    app["log_writers"] = {
+        model: BufferedLogWriter(
+            app["apscron_db"], model, **config.LOG_WRITER_CONFIG)
+        for model in (JobLog, UserLog, ErrorLog)}
+    for writer in app["log_writers"].values():
+        await writer.start()
+    # Shared HTTP client sessions used by jobs
+    app["client_sessions"] = ClientSessionRegistry(
+        **config.HTTP_CLIENT_CONFIG)
+    app["dns_resolver"] = DNSResolver(ttl=config.DNS_CACHE_TTL)
+    # Password hashing runs in its own thread pool
+    app["password_hasher"] = PasswordHasher(**config.PASSWORD_HASHER_CONFIG)
+    await app["password_hasher"].start()
+    # Revoked auth tokens, loaded before requests are served
+    app["revocation_store"] = RevocationStore(
+        app["apscron_db"],
+        RevokedToken if config.REVOCATION_CONFIG["persist"] else None,
+        sync_interval=config.REVOCATION_CONFIG["sync_interval"])
+    await app["revocation_store"].start()
+    # Authenticated users, invalidated when users are edited or deleted
+    app["user_cache"] = TTLCache(config.USER_CACHE_TTL, maxsize=10000)
+    # Log table partitions are created ahead and expired ones dropped
+    if config.LOG_PARTITION_CONFIG["enabled"]:
+        app["log_partitioner"] = get_log_partitioner()
+        await app["log_partitioner"].start()
+    # Start mailer before scheduler, jobs may send emails right away
+    if "mailer" in app:
+        await app["mailer"].start()
     # Start scheduler
     app["apscheduler"].start()
+    # Listen to jobs changed by other apscron processes
+    if "jobstore_listener" in app:
+        await app["jobstore_listener"].start()
     app["app_log"].debug("APScron started")
 
 
 async def close_app(app):
+    # Stop listening to job changes and shutdown scheduler
+    if "jobstore_listener" in app:
+        await app["jobstore_listener"].close()
+    app["apscheduler"].shutdown()
+    # Send queued emails and close SMTP connections
+    if "mailer" in app:
+        await app["mailer"].close()
+    # Close HTTP client connection pools
+    if "client_sessions" in app:
+        await app["client_sessions"].close()
+    if "password_hasher" in app:
+        await app["password_hasher"].close()
+    # Stop syncing revoked tokens
+    if "revocation_store" in app:
+        await app["revocation_store"].close()
+    if "log_partitioner" in app:
+        await app["log_partitioner"].close()
+    # Write buffered logs before database connections are closed
+    for writer in app.get("log_writers", {}).values():
+        await writer.close()
+        writer.log_metrics()
     # Close db connection pool
     if app["apscron_db"].is_connected:
         await app["apscron_db"].close()
-    # Shutdown scheduler
-    app["apscheduler"].shutdown()
     app["app_log"].debug("APScron stopped")
 
 
@@ -81,6 +142,25 @@ def setup_template_functions(jinja_env):
         jinja_env.globals[k] = v
 
 
+def create_template_env(app=None):
+    """Creates jinja environment of the application, or a standalone one
+    when app is not given (job reports rendered in worker processes).
+    Both are created with the same options.
+    """
+    options = {"loader": jinja2.FileSystemLoader(
+                   config.DIRS["TEMPLATE_DIR"]),
+               "bytecode_cache": jinja2.FileSystemBytecodeCache(),
+               "autoescape": True}
+    if app is None:
+        jinja_env = jinja2.Environment(**options)
+    else:
+        jinja_env = aiohttp_jinja2.setup(
+            app, context_processors=[aiohttp_jinja2.request_processor],
+            **options)
+    setup_template_functions(jinja_env)
+    return jinja_env
+
+
 def flash(request, message, variant, title):
     """Manages messages and its display options."""
     if request.get("messages"):
@@ -99,6 +179,23 @@ def convert_types(obj, datetime_format="%Y-%m-%d %H:%M:%S"):
         return str(obj)
 
 
+def json_dumps(obj):
+    """Serializes obj to JSON bytes in a single pass.
+
+    Datetimes are formatted by convert_types, like the rest of unsupported
+    types, dict keys which are not strings are converted to strings.
+    """
+    return orjson.dumps(
+        obj, default=convert_types,
+        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+
+
+def json_response(data, **kwargs):
+    """Gets aiohttp JSON response of data serialized by json_dumps."""
+    return web.Response(body=json_dumps(data), content_type="application/json",
+                        charset="utf-8", **kwargs)
+
+
 def get_static(path):
     """Gets static assets path."""
     path = path or ''
@@ -108,14 +205,14 @@ def get_static(path):
 async def get_error_response(error, status=HTTPStatus.BAD_REQUEST):
     """Gets aiohttp json error response."""
     if isinstance(error, type):
-        return web.json_response(
+        return json_response(
             ControllerResponse(ControllerResult.Failure,
                                messages=[{"message": error.error_message,
                                           "variant": BSVariant.Danger.name,
                                           "title": BSVariant.Danger.title}]),
             status=error.error_status)
     else:
-        return web.json_response(
+        return json_response(
             ControllerResponse(ControllerResult.Failure,
                                messages=[{"message": str(error),
                                           "variant": BSVariant.Danger.name,
@@ -139,5 +236,7 @@ def set_session_user(session, user):
     for k, v in user.items():
         if k in ["id", "username", "permissions", "is_admin", "is_active"]:
             user_data[k] = v
-    session["user"] = user_data
+    # Changed session is encrypted and sent back in a new cookie
+    if session.get("user") != user_data:
+        session["user"] = user_data
     return user_data
@@ -4,11 +4,14 @@ from controllers.users import (UserListController, UserAddController,
                                CommonUserDataController)
 from controllers.jobs import (JobListController, JobAddController,
                               JobEditController, JobDeleteController,
-                              JobPauseController, CommonJobDataController)
+                              JobPauseController, JobReloadController,
+                              CommonJobDataController)
 from controllers.logs import (UserLogController, JobLogController,
-                              ErrorLogController)
+                              ErrorLogController, UserLogExportController,
+                              JobLogExportController,
+                              ErrorLogExportController)
 from utils import get_error_response
-from exceptions import MethodNotAllowedException
+from exceptions import MethodNotAllowedException, NotFoundException
 
 
 async def login_view(request):
@@ -63,6 +66,10 @@ async def pause_job_view(request):
     return await JobPauseController(request).call(**request.match_info)
 
 
+async def reload_job_view(request):
+    return await JobReloadController(request).call(**request.match_info)
+
+
 async def common_job_data(request):
     return await CommonJobDataController(request).call()
 
@@ -79,6 +86,18 @@ async def error_log_view(request):
     return await ErrorLogController(request).call()
 
 
+log_export_controllers = {"users": UserLogExportController,
+                          "jobs": JobLogExportController,
+                          "errors": ErrorLogExportController}
+
+
+async def log_export_view(request):
+    controller = log_export_controllers.get(request.match_info["log_type"])
+    if controller is None:
+        return await get_error_response(NotFoundException)
+    return await controller(request).call()
+
+
 routes = (
     dict(method="POST", path="/auth/login",
          handler=login_view, name="login_view"),
@@ -96,6 +115,8 @@ routes = (
          handler=job_view, name="job_view"),
     dict(method="POST", path="/jobs/pause/{job_id}",
          handler=pause_job_view, name="pause_job_view"),
+    dict(method="POST", path="/jobs/reload/{module}",
+         handler=reload_job_view, name="reload_job_view"),
     dict(method="GET", path="/jobs_common_data",
          handler=common_job_data, name="common_job_data"),
     dict(method="GET", path="/logs/jobs",
@@ -104,4 +125,6 @@ routes = (
          handler=user_log_view, name="user_log_view"),
     dict(method="GET", path="/logs/errors",
          handler=error_log_view, name="error_log_view"),
+    dict(method="GET", path="/logs/{log_type}/export",
+         handler=log_export_view, name="log_export_view"),
 )